@@ -1,9 +1,12 @@
 import eventlet
 eventlet.monkey_patch()
+from eventlet import tpool
 
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, render_template, send_from_directory, jsonify
 from flask_cors import CORS
 from services.websocket_service import WebSocketService
+from services.registry import registry
+from routes.export import export_bp
 import logging
 import os
 
@@ -27,6 +30,14 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 # Inicializar WebSocket
 websocket = WebSocketService(app)
 
+# Exportación en streaming (/export)
+app.register_blueprint(export_bp)
+
+# Warm-up en un hilo del sistema (la carga del índice no cede el control y bloquearía
+# el hub de eventlet): /health sigue respondiendo y /ready devuelve 503 hasta que termine.
+# Se lanza al importar para que también ocurra con cualquier servidor que importe `app`.
+websocket.socketio.start_background_task(tpool.execute, registry.warm_up)
+
 @app.route('/')
 def index():
     """Ruta principal que renderiza el template"""
@@ -36,6 +47,22 @@ def index():
 def test():
     return render_template('test.html')
 
+@app.route('/health')
+def health():
+    """Liveness: el proceso responde"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/ready')
+def ready():
+    """Readiness: solo responde 200 cuando el warm-up ha terminado"""
+    status = registry.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/stats')
+def stats():
+    """Profundidad de la cola de búsqueda y peticiones descartadas por carga"""
+    return jsonify(websocket.get_load_stats())
+
 if __name__ == '__main__':
     # Solo mostrar mensajes si se ejecuta directamente
     if os.environ.get('FLASK_DEBUG') != '1':
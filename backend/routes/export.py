@@ -0,0 +1,79 @@
+from flask import Blueprint, jsonify, request, Response, stream_with_context
+from services.registry import registry
+from services.export_service import EXPORT_FORMATS, export_columns, iter_export_rows, iter_export
+
+export_bp = Blueprint('export', __name__)
+
+
+def _collect_terms(body: dict):
+    """
+    Reúne los términos de term/terms del JSON y de la query string (repetibles).
+    Returns:
+        Lista de términos o None si alguno no es un string
+    """
+    values = []
+    for key in ('term', 'terms'):
+        value = body.get(key)
+        if isinstance(value, list):
+            values.extend(value)
+        elif value is not None:
+            values.append(value)
+        values.extend(request.args.getlist(key))
+    if not all(isinstance(value, str) for value in values):
+        return None
+    return [value for value in values if value.strip()]
+
+
+@export_bp.route('/export', methods=['GET', 'POST'])
+def export():
+    """
+    Exporta resultados de búsqueda o mapeos masivos en streaming (CSV o NDJSON, opcionalmente gzip).
+    Parámetros (query string o JSON en POST):
+        term / terms: Término(s) a mapear; sin términos se exporta el índice completo
+        format: 'csv' (por defecto) o 'ndjson'
+        gzip: '1' para comprimir la salida
+        limit: Máximo de resultados por término
+        system, scale, class: Filtros de facetas
+        maxKeywords, strictMode: Opciones de búsqueda
+    """
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    elif not isinstance(body, dict):
+        return jsonify({'error': 'El cuerpo JSON debe ser un objeto'}), 400
+    params = dict(request.args)
+    params.update(body)
+
+    terms = _collect_terms(body)
+    if terms is None:
+        return jsonify({'error': 'term y terms deben ser strings'}), 400
+
+    export_format = params.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Formato no soportado: {export_format}'}), 400
+    compress = str(params.get('gzip', '')).lower() in ('1', 'true', 'yes')
+
+    try:
+        limit = int(params['limit']) if params.get('limit') else None
+        max_keywords = int(params.get('maxKeywords', 10))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit y maxKeywords deben ser enteros'}), 400
+    strict = str(params.get('strictMode', '')).lower() in ('1', 'true', 'yes')
+    filters = {name: params.get(name) for name in ('system', 'scale', 'class') if params.get(name)}
+
+    index = registry.get('loinc_index')
+    columns = export_columns(terms)
+    rows = iter_export_rows(index, terms, filters=filters, limit=limit,
+                            max_keywords=max_keywords, strict=strict)
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"loinc_export.{extension}"
+    if compress:
+        mimetype = 'application/gzip'
+        filename += '.gz'
+
+    return Response(
+        stream_with_context(iter_export(rows, columns, export_format, compress)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
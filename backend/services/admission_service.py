@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from eventlet.queue import LightQueue, Full, Empty
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        """
+        Bucket de tokens: se recarga a `rate` tokens por segundo hasta un máximo de `burst`.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def try_acquire(self, now: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Intenta consumir un token.
+        Returns:
+            (admitido, segundos hasta que haya un token disponible)
+        """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate
+
+    def refund(self):
+        """Devuelve un token consumido (petición rechazada por otro límite)"""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class AdmissionController:
+    def __init__(self,
+                 per_connection_rate: float,
+                 per_connection_burst: float,
+                 global_rate: float,
+                 global_burst: float):
+        """
+        Control de admisión con un bucket por conexión y otro global por evento.
+        """
+        self.per_connection_rate = per_connection_rate
+        self.per_connection_burst = per_connection_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.connection_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.global_buckets: Dict[str, TokenBucket] = {}
+        self.admitted: Dict[str, int] = {}
+        self.shed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def admit(self, sid: str, event: str) -> Tuple[bool, float]:
+        """
+        Decide si se admite un evento de una conexión.
+        Returns:
+            (admitido, retry_after en segundos)
+        """
+        with self._lock:
+            now = time.monotonic()
+            connection_bucket = self.connection_buckets.get((sid, event))
+            if connection_bucket is None:
+                connection_bucket = TokenBucket(self.per_connection_rate, self.per_connection_burst)
+                self.connection_buckets[(sid, event)] = connection_bucket
+            global_bucket = self.global_buckets.get(event)
+            if global_bucket is None:
+                global_bucket = TokenBucket(self.global_rate, self.global_burst)
+                self.global_buckets[event] = global_bucket
+
+            allowed, retry_after = connection_bucket.try_acquire(now)
+            if allowed:
+                allowed, retry_after = global_bucket.try_acquire(now)
+                if not allowed:
+                    connection_bucket.refund()
+
+            if allowed:
+                self.admitted[event] = self.admitted.get(event, 0) + 1
+            else:
+                self.shed[event] = self.shed.get(event, 0) + 1
+            return allowed, retry_after
+
+    def record_shed(self, event: str):
+        """Cuenta una petición descartada fuera del control de tokens (ej: cola llena)"""
+        with self._lock:
+            self.shed[event] = self.shed.get(event, 0) + 1
+
+    def forget(self, sid: str):
+        """Elimina los buckets de una conexión cerrada"""
+        with self._lock:
+            for key in [key for key in self.connection_buckets if key[0] == sid]:
+                del self.connection_buckets[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de peticiones admitidas y descartadas por evento"""
+        with self._lock:
+            return {
+                'admitted': dict(self.admitted),
+                'shed': dict(self.shed),
+                'connections': len({sid for sid, _ in self.connection_buckets})
+            }
+
+    @classmethod
+    def from_env(cls) -> 'AdmissionController':
+        """Crea el controlador con los límites definidos en variables de entorno"""
+        return cls(
+            per_connection_rate=float(os.getenv('ADMISSION_CONNECTION_RATE', '5')),
+            per_connection_burst=float(os.getenv('ADMISSION_CONNECTION_BURST', '10')),
+            global_rate=float(os.getenv('ADMISSION_GLOBAL_RATE', '100')),
+            global_burst=float(os.getenv('ADMISSION_GLOBAL_BURST', '200'))
+        )
+
+
+class WorkQueue:
+    def __init__(self,
+                 handler: Callable[[List[Any]], None],
+                 spawn: Callable[..., Any],
+                 workers: int,
+                 max_size: int,
+                 is_stale: Optional[Callable[[Any], bool]] = None,
+                 batch_size: int = 1):
+        """
+        Cola acotada atendida por un número fijo de workers.
+        Args:
+            handler: Función que procesa un lote de elementos de la cola
+            spawn: Función para lanzar los workers (ej: socketio.start_background_task)
+            workers: Número de workers
+            max_size: Tamaño máximo de la cola
+            is_stale: Indica si un elemento ya no debe procesarse (ej: su cliente se desconectó)
+            batch_size: Máximo de elementos que un worker toma de la cola de una vez
+        """
+        self.handler = handler
+        self.is_stale = is_stale
+        self.spawn = spawn
+        self.workers = workers
+        self.max_size = max_size
+        self.batch_size = max(1, batch_size)
+        self.queue = LightQueue(max_size)
+        self.started = False
+        self.in_flight = 0
+        self.processed = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.avg_service_time = 0.0
+
+    def start(self):
+        """Lanza los workers (solo la primera vez)"""
+        if self.started:
+            return
+        self.started = True
+        for _ in range(self.workers):
+            self.spawn(self._worker)
+        logger.info(f"👷 {self.workers} workers de búsqueda iniciados")
+
+    def submit(self, item: Any) -> Tuple[bool, float]:
+        """
+        Encola un elemento sin bloquear.
+        Returns:
+            (encolado, retry_after estimado en segundos)
+        """
+        self.start()
+        try:
+            self.queue.put_nowait(item)
+            return True, 0.0
+        except Full:
+            self.rejected += 1
+            return False, self.estimated_wait()
+
+    def estimated_wait(self) -> float:
+        """Tiempo estimado hasta vaciar la cola actual"""
+        service_time = self.avg_service_time or 0.1
+        return round((self.queue.qsize() + self.in_flight) * service_time / self.workers, 3)
+
+    def _next_batch(self) -> List[Any]:
+        """Espera un elemento y añade los que ya estén encolados, hasta batch_size"""
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        if self.is_stale is None:
+            return batch
+        live = [item for item in batch if not self.is_stale(item)]
+        self.skipped += len(batch) - len(live)
+        return live
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            self.in_flight += len(batch)
+            start = time.monotonic()
+            try:
+                self.handler(batch)
+            except Exception as e:
+                logger.error(f"❌ Error en worker: {e}")
+            finally:
+                elapsed = (time.monotonic() - start) / len(batch)
+                # Media móvil exponencial del tiempo de servicio por elemento
+                self.avg_service_time = elapsed if not self.processed else (
+                    0.8 * self.avg_service_time + 0.2 * elapsed
+                )
+                self.in_flight -= len(batch)
+                self.processed += len(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        """Profundidad de la cola y contadores de trabajo"""
+        return {
+            'depth': self.queue.qsize(),
+            'max_size': self.max_size,
+            'workers': self.workers,
+            'batch_size': self.batch_size,
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'rejected': self.rejected,
+            'skipped': self.skipped,
+            'avg_service_time': round(self.avg_service_time, 4)
+        }
@@ -17,13 +17,13 @@ logger = logging.getLogger(__name__)
 # Obtener el directorio raíz del proyecto (2 niveles arriba desde este archivo)
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 
-# Cargar variables de entorno desde el directorio raíz
-load_dotenv(ROOT_DIR / '.env')
-
 class EncryptionService:
     def __init__(self):
         """Inicializa el servicio de encriptación"""
         logger.info("Inicializando encryption service...")
+
+        # Cargar variables de entorno desde el directorio raíz
+        load_dotenv(ROOT_DIR / '.env')
         
         # Obtener el salt del archivo .env
         env_salt = os.getenv('SALT_MASTER_KEY')
@@ -134,6 +134,3 @@ class EncryptionService:
             logger.error(f"Error en desencriptación: {e}")
             logger.error(traceback.format_exc())
             return None
-
-# Crear instancia global
-encryption_service = EncryptionService() 
\ No newline at end of file
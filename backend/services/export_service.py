@@ -0,0 +1,98 @@
+import io
+import csv
+import json
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from .loinc_index import LoincIndex, LOINC_COLUMNS
+
+# Filas que se acumulan antes de enviar un fragmento de la respuesta
+EXPORT_BATCH_ROWS = 500
+
+# Términos por llamada a search_batch (comparten la máscara de filtros; el ranking
+# cuesta lo mismo que término a término)
+EXPORT_BATCH_TERMS = 64
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson')
+}
+
+
+def export_columns(terms: List[str]) -> List[str]:
+    """Columnas de la exportación (con término, posición y score si hay búsqueda)"""
+    if terms:
+        return ['term', 'rank', 'score'] + LOINC_COLUMNS
+    return list(LOINC_COLUMNS)
+
+
+def iter_export_rows(index: LoincIndex,
+                     terms: List[str],
+                     filters: Optional[Dict[str, Any]] = None,
+                     limit: Optional[int] = None,
+                     max_keywords: int = 10,
+                     strict: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Genera las filas a exportar directamente desde el índice.
+    Sin términos recorre el índice completo (filtrado); con términos genera el mapeo
+    término -> códigos de cada búsqueda.
+    """
+    if not terms:
+        yield from index.iter_rows(filters)
+        return
+
+    for start in range(0, len(terms), EXPORT_BATCH_TERMS):
+        batch = terms[start:start + EXPORT_BATCH_TERMS]
+        batch_results = index.search_batch(batch, limit=limit, filters=filters,
+                                           max_keywords=max_keywords, strict=strict)
+        for term, ranked in zip(batch, batch_results):
+            for rank, (doc_id, score) in enumerate(ranked, start=1):
+                row = {'term': term, 'rank': rank, 'score': round(score, 4)}
+                row.update(index.rows[doc_id])
+                yield row
+
+
+def iter_csv(rows: Iterable[Dict[str, Any]], columns: List[str]) -> Iterator[str]:
+    """Serializa las filas como CSV en fragmentos de EXPORT_BATCH_ROWS filas"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= EXPORT_BATCH_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows: Iterable[Dict[str, Any]], columns: List[str]) -> Iterator[str]:
+    """Serializa las filas como NDJSON en fragmentos de EXPORT_BATCH_ROWS filas"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({column: row.get(column) for column in columns}, ensure_ascii=False))
+        if len(lines) >= EXPORT_BATCH_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def iter_gzip(chunks: Iterable[str]) -> Iterator[bytes]:
+    """Comprime los fragmentos en un único flujo gzip sin acumularlos"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(rows: Iterable[Dict[str, Any]], columns: List[str],
+                export_format: str, compress: bool = False) -> Iterator[Any]:
+    """Flujo completo de la exportación en el formato pedido"""
+    serializer = iter_csv if export_format == 'csv' else iter_ndjson
+    chunks = serializer(rows, columns)
+    return iter_gzip(chunks) if compress else chunks
@@ -0,0 +1,392 @@
+import os
+import re
+import csv
+import json
+import math
+import mmap
+import logging
+import unicodedata
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Columnas del fichero LOINC (Loinc.csv) que se guardan en el índice
+LOINC_COLUMNS = [
+    'LOINC_NUM', 'COMPONENT', 'PROPERTY', 'TIME_ASPCT', 'SYSTEM',
+    'SCALE_TYP', 'METHOD_TYP', 'CLASS', 'LONG_COMMON_NAME'
+]
+# Columnas cuyo texto se indexa para la búsqueda
+TEXT_COLUMNS = ['LONG_COMMON_NAME', 'COMPONENT', 'SYSTEM', 'PROPERTY']
+# Facetas por las que se puede filtrar (parámetro -> columna)
+FACETS = {'system': 'SYSTEM', 'scale': 'SCALE_TYP', 'class': 'CLASS'}
+# Arrays de la matriz CSR que se guardan y mapean en memoria
+MATRIX_ARRAYS = ('indptr', 'doc_ids', 'weights')
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens en minúsculas y sin acentos"""
+    normalized = unicodedata.normalize('NFKD', text or '')
+    normalized = ''.join(c for c in normalized if not unicodedata.combining(c))
+    return _TOKEN_RE.findall(normalized.lower())
+
+
+class LoincIndex:
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """Índice invertido en memoria sobre las filas del fichero LOINC con ranking BM25"""
+        self.k1 = k1
+        self.b = b
+        self.rows: List[Dict[str, str]] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+        self.avg_doc_length = 0.0
+        self.facets: Dict[str, Dict[str, set]] = {column: {} for column in FACETS.values()}
+        self.path: Optional[str] = None
+        # Matriz CSR término-documento con los pesos BM25 (se construye bajo demanda)
+        self.vocabulary: Dict[str, int] = {}
+        self.indptr: Optional[np.ndarray] = None
+        self.doc_ids: Optional[np.ndarray] = None
+        self.weights: Optional[np.ndarray] = None
+        # Máscaras por valor de faceta (solo valores existentes, acotado por self.facets)
+        self._facet_masks: Dict[Tuple[str, str], np.ndarray] = {}
+        self._empty_mask: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add_rows(self, rows: Iterable[Dict[str, str]]):
+        """Añade filas al índice"""
+        for row in rows:
+            doc_id = len(self.rows)
+            row = {column: (row.get(column) or '') for column in LOINC_COLUMNS}
+            self.rows.append(row)
+
+            frequencies: Dict[str, int] = {}
+            tokens = tokenize(' '.join(row[column] for column in TEXT_COLUMNS))
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, tf in frequencies.items():
+                self.postings.setdefault(token, []).append((doc_id, tf))
+            self.doc_lengths.append(len(tokens))
+
+            for column in FACETS.values():
+                self.facets[column].setdefault(row[column].lower(), set()).add(doc_id)
+
+        self.avg_doc_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        self.indptr = None
+        self._facet_masks = {}
+        self._empty_mask = None
+
+    def build_matrix(self):
+        """
+        Construye la matriz CSR término-documento con los pesos BM25 ya calculados.
+        La fila de cada término contiene sus documentos (doc_ids) y pesos (weights).
+        """
+        total_docs = len(self.rows)
+        doc_lengths = np.asarray(self.doc_lengths, dtype=np.float64)
+        norms = self.k1 * (1 - self.b + self.b * doc_lengths / (self.avg_doc_length or 1.0))
+
+        self.vocabulary = {token: term_id for term_id, token in enumerate(self.postings)}
+        lengths = np.fromiter((len(p) for p in self.postings.values()), dtype=np.int64,
+                              count=len(self.postings))
+        self.indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.indptr[1:])
+
+        nnz = int(self.indptr[-1])
+        entries = np.array([entry for postings in self.postings.values() for entry in postings],
+                           dtype=np.int64).reshape(nnz, 2)
+        self.doc_ids = entries[:, 0].astype(np.int32)
+        tfs = entries[:, 1].astype(np.float64)
+
+        idf = np.log(1 + (total_docs - lengths + 0.5) / (lengths + 0.5))
+        term_idf = np.repeat(idf, lengths)
+        self.weights = term_idf * tfs * (self.k1 + 1) / (tfs + norms[self.doc_ids])
+        logger.debug(f"🧮 Matriz CSR construida: {len(lengths)} términos, {nnz} entradas")
+
+    def _matrix_meta(self) -> Dict[str, Any]:
+        """Metadatos que identifican la matriz del índice actual"""
+        return {
+            'docs': len(self.rows),
+            'terms': len(self.postings),
+            'source_mtime': os.path.getmtime(self.path) if self.path else None,
+            'k1': self.k1,
+            'b': self.b
+        }
+
+    def save_matrix(self, directory: str):
+        """Guarda la matriz CSR en ficheros .npy para poder mapearla en memoria"""
+        if self.indptr is None:
+            self.build_matrix()
+        os.makedirs(directory, exist_ok=True)
+        for name in MATRIX_ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(self._matrix_meta(), f)
+        logger.info(f"💾 Matriz CSR guardada en {directory}")
+
+    def load_matrix(self, directory: str) -> bool:
+        """
+        Mapea en memoria (mmap, solo lectura) una matriz guardada con save_matrix.
+        Returns:
+            False si no existe o no corresponde al índice actual
+        """
+        meta_path = os.path.join(directory, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, encoding='utf-8') as f:
+            if json.load(f) != self._matrix_meta():
+                logger.warning(f"⚠️ Matriz CSR de {directory} desactualizada")
+                return False
+
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+                  for name in MATRIX_ARRAYS}
+        self.indptr, self.doc_ids, self.weights = (arrays[name] for name in MATRIX_ARRAYS)
+        self.vocabulary = {token: term_id for term_id, token in enumerate(self.postings)}
+        logger.info(f"🗺️ Matriz CSR mapeada en memoria desde {directory}")
+        return True
+
+    def touch_matrix(self) -> int:
+        """
+        Lee una posición por página de los arrays de la matriz para cargarlos en memoria
+        antes de recibir tráfico (evita fallos de página en las primeras búsquedas).
+        Returns:
+            Número de páginas tocadas
+        """
+        if self.indptr is None:
+            self.build_matrix()
+        pages = 0
+        for name in MATRIX_ARRAYS:
+            array = getattr(self, name)
+            step = max(1, mmap.PAGESIZE // array.itemsize)
+            array[::step].sum()
+            pages += -(-len(array) // step)
+        return pages
+
+    def prefill_facet_masks(self):
+        """Precalcula las máscaras de todos los valores de las facetas"""
+        for name, column in FACETS.items():
+            for value in self.facets[column]:
+                if value:
+                    self._filter_mask({name: value})
+
+    @classmethod
+    def from_csv(cls, path: str) -> 'LoincIndex':
+        """Construye el índice a partir de un fichero Loinc.csv"""
+        index = cls()
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            index.add_rows(csv.DictReader(f))
+        index.path = path
+        logger.info(f"📚 Índice LOINC cargado: {len(index)} códigos desde {path}")
+        return index
+
+    @classmethod
+    def from_env(cls) -> 'LoincIndex':
+        """Carga el fichero de LOINC_FILE_PATH (índice vacío si no está definido)"""
+        path = os.getenv('LOINC_FILE_PATH')
+        if not path:
+            logger.warning("⚠️ LOINC_FILE_PATH no definido, índice LOINC vacío")
+            return cls()
+        return cls.from_csv(path)
+
+    def _filter_ids(self, filters: Optional[Dict[str, Any]]) -> Optional[set]:
+        """Documentos que cumplen los filtros de facetas (None = sin filtro)"""
+        allowed = None
+        for name, column in FACETS.items():
+            value = (filters or {}).get(name)
+            if not value:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            ids = set()
+            for v in values:
+                ids |= self.facets[column].get(str(v).lower(), set())
+            allowed = ids if allowed is None else allowed & ids
+        return allowed
+
+    def search_python(self, term: str,
+                      limit: Optional[int] = 10,
+                      filters: Optional[Dict[str, Any]] = None,
+                      max_keywords: int = 10,
+                      strict: bool = False) -> List[Tuple[int, float]]:
+        """
+        Busca un término con BM25 recorriendo las postings en Python.
+        Implementación de referencia de search().
+        Args:
+            term: Texto de búsqueda (se usan hasta max_keywords palabras)
+            limit: Número máximo de resultados (None = todos)
+            filters: Filtros de facetas {'system': ..., 'scale': ..., 'class': ...}
+            max_keywords: Número máximo de palabras clave del término
+            strict: Si es True, todos los términos deben aparecer en el documento
+        Returns:
+            Lista de (doc_id, score) ordenada por score descendente
+        """
+        keywords = list(dict.fromkeys(tokenize(term)))[:max_keywords]
+        if not keywords or not self.rows:
+            return []
+
+        allowed = self._filter_ids(filters)
+        total_docs = len(self.rows)
+        scores: Dict[int, float] = {}
+        matches: Dict[int, int] = {}
+
+        for keyword in keywords:
+            postings = self.postings.get(keyword, [])
+            if not postings:
+                if strict:
+                    return []
+                continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings:
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_doc_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matches[doc_id] = matches.get(doc_id, 0) + 1
+
+        if strict:
+            scores = {doc_id: s for doc_id, s in scores.items() if matches[doc_id] == len(keywords)}
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked if limit is None else ranked[:limit]
+
+    def _keyword_ids(self, term: str, max_keywords: int, strict: bool) -> Optional[List[int]]:
+        """Ids de las palabras clave del término (None si en modo estricto falta alguna)"""
+        keywords = list(dict.fromkeys(tokenize(term)))[:max_keywords]
+        ids = [self.vocabulary[k] for k in keywords if k in self.vocabulary]
+        if strict and len(ids) < len(keywords):
+            return None
+        return ids
+
+    def _filter_mask(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Máscara booleana (bitset por documento) de los filtros de facetas"""
+        mask = None
+        for name, column in FACETS.items():
+            value = (filters or {}).get(name)
+            if not value:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            facet_mask = np.zeros(len(self.rows), dtype=bool)
+            for v in values:
+                facet_mask |= self._value_mask(column, str(v).lower())
+            mask = facet_mask if mask is None else mask & facet_mask
+        return mask
+
+    def _value_mask(self, column: str, value: str) -> np.ndarray:
+        """
+        Máscara de un valor de faceta. Los valores que no existen en el índice comparten
+        una máscara vacía para que la caché no crezca con la entrada de los clientes.
+        """
+        doc_ids = self.facets[column].get(value)
+        if not doc_ids:
+            if self._empty_mask is None or len(self._empty_mask) != len(self.rows):
+                self._empty_mask = np.zeros(len(self.rows), dtype=bool)
+            return self._empty_mask
+        key = (column, value)
+        if key not in self._facet_masks:
+            value_mask = np.zeros(len(self.rows), dtype=bool)
+            value_mask[list(doc_ids)] = True
+            self._facet_masks[key] = value_mask
+        return self._facet_masks[key]
+
+    def _gather(self, term_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Concatena las filas CSR (documentos y pesos) de varios términos"""
+        if not term_ids:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+        slices = [slice(self.indptr[t], self.indptr[t + 1]) for t in term_ids]
+        return (np.concatenate([self.doc_ids[s] for s in slices]),
+                np.concatenate([self.weights[s] for s in slices]))
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, limit: Optional[int]) -> List[Tuple[int, float]]:
+        """Top-k con argpartition, ordenado por score descendente y doc_id"""
+        candidates = np.flatnonzero(scores > 0)
+        if limit is not None and len(candidates) > limit:
+            if limit <= 0:
+                return []
+            partition = np.argpartition(-scores[candidates], limit - 1)
+            # Conservar los empates con el k-ésimo para desempatar por doc_id como en Python
+            kth_score = scores[candidates[partition[limit - 1]]]
+            candidates = candidates[scores[candidates] >= kth_score]
+        order = np.lexsort((candidates, -scores[candidates]))
+        candidates = candidates[order][:limit]
+        return list(zip(candidates.tolist(), scores[candidates].tolist()))
+
+    def search(self, term: str,
+               limit: Optional[int] = 10,
+               filters: Optional[Dict[str, Any]] = None,
+               max_keywords: int = 10,
+               strict: bool = False) -> List[Tuple[int, float]]:
+        """
+        Busca un término con BM25 usando operaciones vectorizadas sobre la matriz CSR.
+        Args:
+            term: Texto de búsqueda (se usan hasta max_keywords palabras)
+            limit: Número máximo de resultados (None = todos)
+            filters: Filtros de facetas {'system': ..., 'scale': ..., 'class': ...}
+            max_keywords: Número máximo de palabras clave del término
+            strict: Si es True, todos los términos deben aparecer en el documento
+        Returns:
+            Lista de (doc_id, score) ordenada por score descendente
+        """
+        return self.search_batch([term], limit=limit, filters=filters,
+                                 max_keywords=max_keywords, strict=strict)[0]
+
+    def search_batch(self, terms: Sequence[str],
+                     limit: Optional[int] = 10,
+                     filters: Optional[Dict[str, Any]] = None,
+                     max_keywords: int = 10,
+                     strict: bool = False) -> List[List[Tuple[int, float]]]:
+        """
+        Busca varios términos con las mismas opciones.
+        Equivale a llamar a search() por término: solo se comparte el trabajo por llamada
+        (máscara de filtros, comprobación de la matriz). Los postings de una consulta
+        típica cubren buena parte del índice, así que acumular un lote (matriz densa
+        consultas x documentos o np.unique sobre los postings) no es más rápido que un
+        bincount denso por consulta.
+        Returns:
+            Resultados de cada término, como en search()
+        """
+        if not self.rows:
+            return [[] for _ in terms]
+        if self.indptr is None:
+            self.build_matrix()
+
+        total_docs = len(self.rows)
+        mask = self._filter_mask(filters)
+        excluded = ~mask if mask is not None else None
+        results: List[List[Tuple[int, float]]] = []
+
+        for term in terms:
+            ids = self._keyword_ids(term, max_keywords, strict)
+            if not ids:
+                results.append([])
+                continue
+            docs, weights = self._gather(ids)
+            scores = np.bincount(docs, weights=weights, minlength=total_docs)
+            if strict:
+                scores[np.bincount(docs, minlength=total_docs) != len(ids)] = 0.0
+            if excluded is not None:
+                scores[excluded] = 0.0
+            results.append(self._top_k(scores, limit))
+        return results
+
+    def iter_rows(self, filters: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, str]]:
+        """Recorre las filas del índice (opcionalmente filtradas) sin copiarlas"""
+        allowed = self._filter_ids(filters)
+        for doc_id, row in enumerate(self.rows):
+            if allowed is None or doc_id in allowed:
+                yield row
+
+    def result(self, doc_id: int, score: float) -> Dict[str, Any]:
+        """Resultado de búsqueda listo para enviar al cliente"""
+        row = self.rows[doc_id]
+        return {
+            'code': row['LOINC_NUM'],
+            'name': row['LONG_COMMON_NAME'],
+            'system': row['SYSTEM'],
+            'scale': row['SCALE_TYP'],
+            'class': row['CLASS'],
+            'score': round(score, 4)
+        }
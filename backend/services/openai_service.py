@@ -1,9 +1,17 @@
 import os
+import re
+import json
+import hashlib
 import logging
-from openai import OpenAI
-from typing import Optional, Dict, Any
-from .encryption_service import encryption_service
-from .websocket_service import WebSocketService
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from .registry import registry
+
+# Tokens de salida reservados en el rerank: cada código va como '"NNNNN-N", ' dentro de
+# {"results": [{"query": n, "ranking": [...]}]}
+RERANK_OUTPUT_TOKENS_PER_CODE = 10
+RERANK_OUTPUT_TOKENS_PER_QUERY = 20
+RERANK_OUTPUT_TOKENS_BASE = 20
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -12,33 +20,46 @@ logger = logging.getLogger(__name__)
 class OpenAIService:
     def __init__(self):
         """Inicializa el servicio de OpenAI"""
-        self.client = None
         self.model = "gpt-4"  # Modelo por defecto
-        self.initialized = False
         self.websocket_service = None
-        self.encryption_service = encryption_service  # Usar instancia global
+        self.encryption_service = None  # Se obtiene del registro al inicializar
+        # Rerank de candidatos locales
+        self.rerank_top_k = int(os.getenv('RERANK_TOP_K', '20'))
+        self.rerank_token_budget = int(os.getenv('RERANK_TOKEN_BUDGET', '3000'))
+        self.rerank_cache_size = int(os.getenv('RERANK_CACHE_SIZE', '1000'))
+        self.rerank_cache: OrderedDict = OrderedDict()
+        # Cliente de cada instalación con la API key cifrada con la que se creó
+        # (installTimestamp -> (key cifrada, cliente)); nunca se comparte entre instalaciones
+        self.clients: Dict[str, Tuple[Any, Any]] = {}
         logger.info("🤖 Servicio OpenAI creado")
 
-    def initialize(self, websocket_service):
-        """Inicializa el servicio OpenAI con la API key del WebSocket"""
+    @staticmethod
+    def stored_key(websocket_service, install_timestamp: str) -> Optional[str]:
+        """API key cifrada que la instalación tiene guardada en el WebSocket"""
+        storage_data = websocket_service.install_storage.get(str(install_timestamp)) or {}
+        return storage_data.get('openai_api_key') or storage_data.get('openaiApiKey')
+
+    def initialize(self, websocket_service, install_timestamp: str) -> bool:
+        """Inicializa el cliente OpenAI de una instalación con su API key del WebSocket"""
         try:
-            # Obtener datos del WebSocket
-            storage_data = websocket_service.storage_data
+            # Obtener datos de la instalación en el WebSocket
+            storage_data = websocket_service.install_storage.get(str(install_timestamp))
             if not storage_data:
                 logger.error("❌ No hay datos en el WebSocket")
                 return False
                 
-            # Obtener API key y timestamp
-            encrypted_key = storage_data.get('openai_api_key')
-            install_timestamp = storage_data.get('installTimestamp')
+            # Obtener API key
+            encrypted_key = self.stored_key(websocket_service, install_timestamp)
             
-            if not encrypted_key or not install_timestamp:
-                logger.error("❌ Falta API key o timestamp en el WebSocket")
+            if not encrypted_key:
+                logger.error("❌ Falta API key de la instalación en el WebSocket")
                 logger.debug(f"📝 Datos disponibles: {list(storage_data.keys())}")
                 return False
                 
             # Desencriptar API key
             logger.info("\n🔄 Desencriptando API key...")
+            if self.encryption_service is None:
+                self.encryption_service = registry.get('encryption')
             api_key = self.encryption_service.decrypt(encrypted_key, install_timestamp)
             
             if not api_key:
@@ -50,12 +71,13 @@ class OpenAIService:
                 logger.error("❌ API key inválida (debe empezar con 'sk-')")
                 return False
                 
-            logger.info(f"\n🔓 API Key desencriptada: {api_key}")
+            logger.info("\n🔓 API Key desencriptada")
                 
             # Inicializar cliente OpenAI
             logger.debug("🔄 Inicializando cliente OpenAI...")
-            self.client = OpenAI(api_key=api_key)
-            self.initialized = True
+            # Importar el SDK solo cuando se necesita
+            from openai import OpenAI
+            self.clients[str(install_timestamp)] = (encrypted_key, OpenAI(api_key=api_key))
             logger.debug("✅ Cliente OpenAI inicializado")
             
             return True
@@ -64,13 +86,36 @@ class OpenAIService:
             logger.error(f"❌ Error inicializando OpenAI: {e}")
             return False
 
-    def test_connection(self) -> Dict[str, Any]:
+    def ensure_client(self, websocket_service, install_timestamp: str) -> bool:
+        """
+        Garantiza que la instalación tiene un cliente creado con su API key actual.
+        Si la key guardada ha cambiado (rotación o corrección) se crea un cliente nuevo.
+        """
+        entry = self.clients.get(str(install_timestamp))
+        if entry is not None and entry[0] == self.stored_key(websocket_service, install_timestamp):
+            return True
+        self.forget(install_timestamp)
+        return self.initialize(websocket_service, install_timestamp)
+
+    def forget(self, install_timestamp: str):
+        """Descarta el cliente de una instalación (key cambiada o instalación liberada)"""
+        if self.clients.pop(str(install_timestamp), None) is not None:
+            logger.debug("🧹 Cliente OpenAI de la instalación descartado")
+
+    def _client_for(self, install_timestamp: str):
+        entry = self.clients.get(str(install_timestamp))
+        return entry[1] if entry is not None else None
+
+    def test_connection(self, install_timestamp: str) -> Dict[str, Any]:
         """
         Prueba la conexión con OpenAI
+        Args:
+            install_timestamp: Instalación cuyo cliente se prueba
         Returns:
             Dict con el estado de la conexión
         """
-        if not self.initialized:
+        client = self._client_for(install_timestamp)
+        if client is None:
             return {
                 'status': 'error',
                 'message': 'Cliente no inicializado'
@@ -78,7 +123,7 @@ class OpenAIService:
 
         try:
             # Hacer una llamada simple para probar la conexión
-            response = self.client.chat.completions.create(
+            response = client.chat.completions.create(
                 model=self.model,
                 messages=[
                     {"role": "user", "content": "Test connection"}
@@ -116,5 +161,183 @@ class OpenAIService:
             logger.error(f"❌ Error cambiando modelo: {e}")
             return False
 
-# Crear instancia global
-openai_service = OpenAIService() 
\ No newline at end of file
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """Estimación aproximada de tokens (~4 caracteres por token)"""
+        return len(text) // 4 + 1
+
+    @staticmethod
+    def _candidate_set_hash(candidates: List[Dict[str, Any]]) -> str:
+        """Hash estable del conjunto de candidatos (independiente del orden)"""
+        codes = sorted(str(candidate['code']) for candidate in candidates)
+        return hashlib.sha1('|'.join(codes).encode()).hexdigest()
+
+    def _rerank_cache_get(self, key: Tuple[str, str, str]) -> Optional[List[str]]:
+        if key not in self.rerank_cache:
+            return None
+        self.rerank_cache.move_to_end(key)
+        return self.rerank_cache[key]
+
+    def _rerank_cache_put(self, key: Tuple[str, str, str], ranking: List[str]):
+        self.rerank_cache[key] = ranking
+        self.rerank_cache.move_to_end(key)
+        while len(self.rerank_cache) > self.rerank_cache_size:
+            self.rerank_cache.popitem(last=False)
+
+    @staticmethod
+    def _format_query_block(index: int, term: str, candidates: List[Dict[str, Any]]) -> str:
+        """Bloque del prompt con una consulta y sus candidatos"""
+        lines = [f"Q{index}: {term}"]
+        lines.extend(f"- {candidate['code']} | {candidate.get('name', '')}" for candidate in candidates)
+        return '\n'.join(lines)
+
+    def _rerank_prompt_header(self) -> str:
+        return (
+            "Eres un experto en terminología LOINC. Para cada consulta Qn, reordena sus "
+            "candidatos del más al menos relevante. Usa solo los códigos dados, no inventes "
+            "códigos nuevos. Responde únicamente con JSON: "
+            '{"results": [{"query": n, "ranking": ["codigo", ...]}]}'
+        )
+
+    def _build_rerank_batches(self, queries: List[Dict[str, Any]]) -> List[List[int]]:
+        """
+        Agrupa las consultas en lotes cuyo prompt estimado no supera el presupuesto de tokens.
+        Las consultas que no caben solas se recortan a menos candidatos.
+        Returns:
+            Lista de lotes con los índices de las consultas
+        """
+        header_tokens = self._estimate_tokens(self._rerank_prompt_header())
+        batches = []
+        current = []
+        current_tokens = header_tokens
+
+        for index, query in enumerate(queries):
+            block_tokens = self._estimate_tokens(
+                self._format_query_block(index, query['term'], query['candidates'])
+            )
+            while block_tokens + header_tokens > self.rerank_token_budget and len(query['candidates']) > 1:
+                query['rest'] = query['candidates'][-1:] + query.get('rest', [])
+                query['candidates'] = query['candidates'][:-1]
+                block_tokens = self._estimate_tokens(
+                    self._format_query_block(index, query['term'], query['candidates'])
+                )
+
+            if current and current_tokens + block_tokens > self.rerank_token_budget:
+                batches.append(current)
+                current = []
+                current_tokens = header_tokens
+            current.append(index)
+            current_tokens += block_tokens
+
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def _parse_rerank_response(content: str) -> Dict[int, List[str]]:
+        """Extrae {índice de consulta: ranking de códigos} de la respuesta del modelo"""
+        # Quitar posibles bloques ```json ... ```
+        content = re.sub(r'^```(?:json)?\s*|\s*```$', '', content.strip())
+        parsed = json.loads(content)
+        rankings = {}
+        for result in parsed.get('results', []):
+            query = result.get('query')
+            if isinstance(query, str):
+                query = int(query.lstrip('Qq'))
+            rankings[query] = [str(code) for code in result.get('ranking', [])]
+        return rankings
+
+    @staticmethod
+    def _apply_ranking(candidates: List[Dict[str, Any]], ranking: List[str]) -> List[Dict[str, Any]]:
+        """
+        Reordena los candidatos según el ranking.
+        Ignora códigos desconocidos y mantiene al final, en su orden original, los no mencionados.
+        """
+        by_code = {str(candidate['code']): candidate for candidate in candidates}
+        ordered = []
+        seen = set()
+        for code in ranking:
+            if code in by_code and code not in seen:
+                ordered.append(by_code[code])
+                seen.add(code)
+        ordered.extend(c for c in candidates if str(c['code']) not in seen)
+        return ordered
+
+    def rerank_batch(self, queries: List[Dict[str, Any]],
+                     install_timestamp: str) -> List[List[Dict[str, Any]]]:
+        """
+        Reordena con el LLM los candidatos locales de varias consultas usando prompts por lotes.
+        Args:
+            queries: Lista de {'term': str, 'candidates': [{'code': str, 'name': str, ...}]}
+                con los candidatos ya ordenados por el índice local
+            install_timestamp: Instalación cuyo cliente (y API key) se usa
+        Returns:
+            Candidatos reordenados de cada consulta (orden original si el LLM no está disponible)
+        """
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+        pending = []
+
+        for index, query in enumerate(queries):
+            candidates = list(query.get('candidates') or [])
+            top = candidates[:self.rerank_top_k]
+            rest = candidates[self.rerank_top_k:]
+            if len(top) < 2:
+                results[index] = candidates
+                continue
+            key = (query['term'], self._candidate_set_hash(top), self.model)
+            ranking = self._rerank_cache_get(key)
+            if ranking is not None:
+                results[index] = self._apply_ranking(top, ranking) + rest
+                continue
+            pending.append({'index': index, 'term': query['term'], 'candidates': top, 'rest': rest, 'key': key})
+
+        client = self._client_for(install_timestamp)
+        if pending and client is None:
+            logger.warning("⚠️ Rerank omitido: cliente OpenAI no inicializado")
+        elif pending:
+            for batch in self._build_rerank_batches(pending):
+                self._rerank_request(client, [pending[i] for i in batch])
+
+        for query in pending:
+            results[query['index']] = query.get('ranked', query['candidates'] + query['rest'])
+        return results
+
+    @staticmethod
+    def _rerank_max_tokens(batch: List[Dict[str, Any]]) -> int:
+        """Tokens de salida necesarios para la respuesta JSON de un lote"""
+        return RERANK_OUTPUT_TOKENS_BASE + sum(
+            len(query['candidates']) * RERANK_OUTPUT_TOKENS_PER_CODE + RERANK_OUTPUT_TOKENS_PER_QUERY
+            for query in batch
+        )
+
+    def _rerank_request(self, client, batch: List[Dict[str, Any]]):
+        """Envía un lote de consultas en un único prompt y guarda el ranking en cada consulta"""
+        blocks = [self._format_query_block(i, query['term'], query['candidates'])
+                  for i, query in enumerate(batch)]
+        try:
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": self._rerank_prompt_header()},
+                    {"role": "user", "content": '\n\n'.join(blocks)}
+                ],
+                max_tokens=self._rerank_max_tokens(batch),
+                temperature=0
+            )
+            rankings = self._parse_rerank_response(response.choices[0].message.content)
+        except Exception as e:
+            logger.error(f"❌ Error en rerank por lotes: {e}")
+            return
+
+        for i, query in enumerate(batch):
+            if i not in rankings:
+                continue
+            ranked = self._apply_ranking(query['candidates'], rankings[i])
+            self._rerank_cache_put(query['key'], [str(c['code']) for c in ranked])
+            query['ranked'] = ranked + query['rest']
+        logger.info(f"✅ Rerank de {len(batch)} consultas en un solo prompt")
+
+    def rerank(self, term: str, candidates: List[Dict[str, Any]],
+               install_timestamp: str) -> List[Dict[str, Any]]:
+        """Reordena con el LLM los candidatos locales de una consulta"""
+        return self.rerank_batch([{'term': term, 'candidates': candidates}], install_timestamp)[0]
@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+from typing import Any, Callable, Dict, List, Set, Tuple
+from eventlet import patcher
+
+# Locks del sistema aunque eventlet haya parcheado threading: el warm-up se ejecuta
+# en un hilo real (tpool) y un lock verde no despierta a los greenlets que esperan
+_threading = patcher.original('threading')
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ServiceRegistry:
+    def __init__(self):
+        """
+        Registro de servicios con construcción perezosa.
+        Los servicios se crean la primera vez que se piden, no al importar el módulo.
+        """
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._warmups: List[Tuple[str, Callable[[], None]]] = []
+        # Servicios que se están construyendo (la factoría corre fuera del lock)
+        self._building: Set[str] = set()
+        self._lock = _threading.RLock()
+        self.ready = False
+        self.warming = False
+        self.warmup_timings: Dict[str, float] = {}
+        self.warmup_errors: Dict[str, str] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        """Registra la factoría de un servicio"""
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def add_warmup(self, name: str, stage: Callable[[], None]):
+        """Añade una etapa a la fase de warm-up"""
+        with self._lock:
+            self._warmups = [(n, s) for n, s in self._warmups if n != name]
+            self._warmups.append((name, stage))
+
+    def get(self, name: str) -> Any:
+        """
+        Obtiene un servicio, construyéndolo si todavía no existe.
+        Si otro hilo lo está construyendo (ej: el warm-up) se espera con time.sleep, que
+        con eventlet cede el control en lugar de bloquear el hub.
+        """
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        while True:
+            with self._lock:
+                if name in self._instances:
+                    return self._instances[name]
+                if name not in self._factories:
+                    raise KeyError(f"Servicio no registrado: {name}")
+                if name not in self._building:
+                    self._building.add(name)
+                    factory = self._factories[name]
+                    break
+            time.sleep(0.01)
+
+        try:
+            start = time.monotonic()
+            instance = factory()
+            with self._lock:
+                self._instances[name] = instance
+            logger.info(f"🧩 Servicio '{name}' creado en {time.monotonic() - start:.3f}s")
+            return instance
+        finally:
+            with self._lock:
+                self._building.discard(name)
+
+    def is_created(self, name: str) -> bool:
+        """Indica si un servicio ya se ha construido"""
+        return name in self._instances
+
+    def warm_up(self) -> bool:
+        """
+        Ejecuta las etapas de warm-up en orden.
+        El registro queda listo solo si todas terminan sin errores.
+        """
+        with self._lock:
+            if self.warming:
+                return self.ready
+            self.warming = True
+            stages = list(self._warmups)
+
+        logger.info("🔥 Iniciando warm-up de servicios...")
+        errors = {}
+        for name, stage in stages:
+            start = time.monotonic()
+            try:
+                stage()
+            except Exception as e:
+                logger.error(f"❌ Error en warm-up '{name}': {e}")
+                errors[name] = str(e)
+            self.warmup_timings[name] = round(time.monotonic() - start, 4)
+
+        self.warmup_errors = errors
+        self.ready = not errors
+        self.warming = False
+        if self.ready:
+            logger.info("✅ Warm-up completado, servicio listo")
+        return self.ready
+
+    def status(self) -> Dict[str, Any]:
+        """Estado de preparación para el endpoint de readiness"""
+        return {
+            'ready': self.ready,
+            'warming': self.warming,
+            'services': sorted(self._instances),
+            'stages': dict(self.warmup_timings),
+            'errors': dict(self.warmup_errors)
+        }
+
+
+def _create_encryption_service():
+    from .encryption_service import EncryptionService
+    return EncryptionService()
+
+
+def _create_openai_service():
+    from .openai_service import OpenAIService
+    return OpenAIService()
+
+
+def _create_loinc_index():
+    from .loinc_index import LoincIndex
+    return LoincIndex.from_env()
+
+
+def _warm_loinc_index():
+    """
+    Carga el índice LOINC antes de recibir tráfico: mapea en memoria su matriz CSR
+    (LOINC_MATRIX_DIR, se genera si no existe), toca sus páginas y precalcula las
+    máscaras de facetas.
+    """
+    index = registry.get('loinc_index')
+    if not len(index):
+        return
+    matrix_dir = os.getenv('LOINC_MATRIX_DIR')
+    if matrix_dir:
+        if not index.load_matrix(matrix_dir):
+            index.save_matrix(matrix_dir)
+            index.load_matrix(matrix_dir)
+    else:
+        index.build_matrix()
+    pages = index.touch_matrix()
+    index.prefill_facet_masks()
+    logger.info(f"📚 Índice LOINC preparado ({pages} páginas de la matriz en memoria)")
+
+
+def _warm_encryption_keys():
+    """Pre-deriva las master keys de las instalaciones conocidas (WARMUP_INSTALLS)"""
+    encryption_service = registry.get('encryption')
+    installs = [i.strip() for i in os.getenv('WARMUP_INSTALLS', '').split(',') if i.strip()]
+    for install_timestamp in installs:
+        encryption_service.get_key_for_install(install_timestamp)
+    logger.info(f"🔑 {len(installs)} master keys pre-derivadas")
+
+
+# Registro global (no construye ningún servicio al importarse)
+registry = ServiceRegistry()
+registry.register('encryption', _create_encryption_service)
+registry.register('openai', _create_openai_service)
+registry.register('loinc_index', _create_loinc_index)
+registry.add_warmup('loinc_index', _warm_loinc_index)
+registry.add_warmup('encryption_keys', _warm_encryption_keys)
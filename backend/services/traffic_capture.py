@@ -0,0 +1,155 @@
+import os
+import gzip
+import atexit
+import json
+import time
+import hmac
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Eventos que se graban
+CAPTURED_EVENTS = ('search.perform', 'storage.get_value', 'storage.set_value', 'storage.get_all')
+
+# Claves cuyo valor nunca se escribe en el log
+REDACTED_KEYS = {'openaiApiKey', 'openai_api_key', 'apiKey', 'apiKeys'}
+REDACTED = '[REDACTED]'
+
+
+def _pseudonym(value: Any, secret: bytes) -> str:
+    """
+    Identificador estable que no revela el valor original.
+    Es un HMAC con la clave de la grabación: un hash sin clave de un installTimestamp
+    (milisegundos de una ventana de fechas acotada) se invierte por fuerza bruta.
+    """
+    return hmac.new(secret, str(value).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def redact(value: Any, secret: bytes) -> Any:
+    """
+    Copia del payload sin secretos: API keys ocultas e installTimestamp seudonimizado
+    (es la entrada de la derivación de la master key).
+    """
+    if isinstance(value, dict):
+        redacted = {}
+        for key, item in value.items():
+            if key in REDACTED_KEYS:
+                redacted[key] = REDACTED if item is not None else None
+            elif key == 'installTimestamp' and item is not None:
+                redacted[key] = _pseudonym(item, secret)
+            else:
+                redacted[key] = redact(item, secret)
+        # storage.set_value lleva la clave y el valor por separado
+        if value.get('key') in REDACTED_KEYS and 'value' in value:
+            redacted['value'] = REDACTED
+        elif value.get('key') == 'installTimestamp' and value.get('value') is not None:
+            redacted['value'] = _pseudonym(value['value'], secret)
+        return redacted
+    if isinstance(value, list):
+        return [redact(item, secret) for item in value]
+    if isinstance(value, str) and value.startswith('sk-'):
+        return REDACTED
+    return value
+
+
+def _open(path: str, mode: str):
+    """Abre el log, comprimido con gzip si la ruta termina en .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8', buffering=-1 if mode == 'r' else 1)
+
+
+class TrafficRecorder:
+    def __init__(self, path: str, flush_every: int = 100, flush_interval: float = 5.0):
+        """
+        Graba el tráfico de WebSocket en un log NDJSON (una línea por evento).
+        Cada línea: {"t": segundos desde el inicio, "s": sesión, "e": evento, "d": payload}
+        Args:
+            path: Ruta del log (.gz para comprimirlo)
+            flush_every: Eventos como máximo entre dos volcados a disco
+            flush_interval: Segundos como máximo entre dos volcados a disco
+        """
+        self.path = path
+        self.start = time.monotonic()
+        self.count = 0
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self._flushed_count = 0
+        self._flushed_at = self.start
+        # Clave de los seudónimos: aleatoria por grabación, estable dentro del log para que
+        # la reproducción agrupe sesiones e instalaciones, y nunca se escribe en disco
+        self._secret = os.urandom(32)
+        self._lock = threading.Lock()
+        self._file = _open(path, 'a')
+        # El gzip solo escribe su cola al cerrarse: cerrar también al salir del proceso
+        atexit.register(self.close)
+        logger.info(f"🎙️ Grabando tráfico en {path}")
+
+    def record(self, sid: str, event: str, data: Optional[Dict[str, Any]]):
+        """Añade un evento al log con el payload redactado"""
+        if event not in CAPTURED_EVENTS:
+            return
+        line = json.dumps({
+            't': round(time.monotonic() - self.start, 4),
+            's': _pseudonym(sid, self._secret),
+            'e': event,
+            'd': redact(data or {}, self._secret)
+        }, separators=(',', ':'), ensure_ascii=False)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line + '\n')
+            self.count += 1
+            now = time.monotonic()
+            if (self.count - self._flushed_count >= self.flush_every
+                    or now - self._flushed_at >= self.flush_interval):
+                self._flush(now)
+
+    def _flush(self, now: float):
+        """Vuelca a disco lo grabado (en .gz escribe un punto de sincronización legible)"""
+        self._file.flush()
+        self._flushed_count = self.count
+        self._flushed_at = now
+
+    def close(self):
+        """Cierra el log (se puede llamar varias veces)"""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.close()
+        atexit.unregister(self.close)
+        logger.info(f"🎙️ Grabación cerrada: {self.count} eventos en {self.path}")
+
+    @classmethod
+    def from_env(cls) -> Optional['TrafficRecorder']:
+        """
+        Crea el grabador si TRAFFIC_CAPTURE_PATH está definido.
+        TRAFFIC_CAPTURE_FLUSH_EVERY y TRAFFIC_CAPTURE_FLUSH_SECONDS limitan lo que se
+        puede perder si el proceso muere sin cerrar el log.
+        """
+        path = os.getenv('TRAFFIC_CAPTURE_PATH')
+        if not path:
+            return None
+        return cls(path,
+                   flush_every=int(os.getenv('TRAFFIC_CAPTURE_FLUSH_EVERY', '100')),
+                   flush_interval=float(os.getenv('TRAFFIC_CAPTURE_FLUSH_SECONDS', '5')))
+
+
+def read_traffic(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Lee un log de tráfico grabado.
+    Un .gz que sigue abierto (o cuyo proceso murió) se lee hasta el último volcado.
+    """
+    with _open(path, 'r') as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        except EOFError:
+            logger.warning(f"⚠️ {path} no está cerrado; se lee hasta el último volcado")
@@ -1,16 +1,17 @@
-from flask_socketio import SocketIO, emit
-from typing import Dict, Any
+from flask import request
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from typing import Dict, Any, List, Optional
+import os
 import json
-import eventlet
 import logging
-from .encryption_service import encryption_service
+from .registry import registry
+from .admission_service import AdmissionController, WorkQueue
+from .traffic_capture import TrafficRecorder
 
 # Configurar logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-eventlet.monkey_patch()
-
 class WebSocketService:
     def __init__(self, app):
         self.app = app
@@ -22,25 +23,321 @@ class WebSocketService:
             engineio_logger=False,
             transports=['websocket']
         )
-        # Almacenamiento en memoria de la configuración
-        self.storage_data = {
+        # Almacenamiento en memoria de la configuración, un espacio por instalación
+        self.install_storage: Dict[str, Dict[str, Any]] = {}
+        # Espacio privado de las sesiones que aún no tienen instalación (sid -> valores)
+        self.session_storage: Dict[str, Dict[str, Any]] = {}
+        # Instalación asociada a cada sesión (sid -> installTimestamp)
+        self.session_installs: Dict[str, str] = {}
+        # Sesiones conectadas de cada instalación (installTimestamp -> sids)
+        self.install_sessions: Dict[str, set] = {}
+        # Almacenar último valor para comparar cambios (por instalación)
+        self.last_values: Dict[str, Dict[str, Any]] = {}
+        # Sesiones conectadas (para descartar trabajo de clientes ya desconectados)
+        self.connected_sids: set = set()
+        # Control de admisión y cola acotada para los eventos costosos
+        self.admission = AdmissionController.from_env()
+        self.search_queue = WorkQueue(
+            handler=self._process_search,
+            spawn=self.socketio.start_background_task,
+            workers=int(os.getenv('SEARCH_WORKERS', '4')),
+            max_size=int(os.getenv('SEARCH_QUEUE_SIZE', '100')),
+            is_stale=lambda item: item['sid'] not in self.connected_sids,
+            batch_size=int(os.getenv('SEARCH_BATCH_SIZE', '16'))
+        )
+        # Grabación opcional del tráfico (TRAFFIC_CAPTURE_PATH)
+        self.recorder = TrafficRecorder.from_env()
+        self._setup_handlers()
+
+    @staticmethod
+    def _default_storage() -> Dict[str, Any]:
+        """Valores iniciales del espacio de almacenamiento de una instalación"""
+        return {
             'searchConfig': {},
             'openaiApiKey': None,
             'installTimestamp': None
         }
-        # Almacenar último valor para comparar cambios
-        self.last_values = {}
-        self._setup_handlers()
+
+    @staticmethod
+    def _room_for(install_id: str) -> str:
+        """Nombre de la sala Socket.IO de una instalación"""
+        return f"install:{install_id}"
+
+    @staticmethod
+    def _session_key(sid: str) -> str:
+        """Ámbito de last_values de una sesión sin instalación asociada"""
+        return f"session:{sid}"
+
+    @staticmethod
+    def _valid_install_id(install_id: Any) -> bool:
+        """
+        Un installTimestamp enviado por el cliente no puede usar el prefijo reservado
+        de los ámbitos de sesión.
+        """
+        return isinstance(install_id, (str, int)) and not str(install_id).startswith('session:')
+
+    def get_storage(self, install_id: str) -> Dict[str, Any]:
+        """Obtiene (o crea) el espacio de almacenamiento de una instalación"""
+        install_id = str(install_id)
+        if install_id not in self.install_storage:
+            storage = self._default_storage()
+            storage['installTimestamp'] = install_id
+            self.install_storage[install_id] = storage
+        return self.install_storage[install_id]
+
+    def _bind_session(self, sid: str, install_id: str) -> bool:
+        """
+        Asocia una sesión a una instalación y la une a su sala.
+        Los valores guardados antes de conocer la instalación se trasladan a su espacio.
+        Returns:
+            False si el installTimestamp no es válido
+        """
+        if not self._valid_install_id(install_id):
+            logger.warning("⚠️ installTimestamp no válido, se ignora")
+            return False
+        install_id = str(install_id)
+        current = self.session_installs.get(sid)
+        if current == install_id:
+            return True
+
+        if current is not None:
+            self._release_session(sid)
+
+        pending = self.session_storage.pop(sid, None)
+        storage = self.get_storage(install_id)
+        if pending:
+            for key, value in pending.items():
+                if key != 'installTimestamp' and value not in (None, {}):
+                    storage[key] = value
+
+        self.session_installs[sid] = install_id
+        self.install_sessions.setdefault(install_id, set()).add(sid)
+        join_room(self._room_for(install_id), sid=sid)
+        logger.debug(f"🏠 Sesión unida a la instalación {install_id}")
+        return True
+
+    def _release_session(self, sid: str):
+        """
+        Separa una sesión de su instalación.
+        Cuando la sala se queda vacía se libera el espacio de la instalación; el frontend
+        vuelve a sincronizar sus valores al reconectar.
+        """
+        install_id = self.session_installs.pop(sid, None)
+        if install_id is None:
+            return
+        leave_room(self._room_for(install_id), sid=sid)
+        sessions = self.install_sessions.get(install_id, set())
+        sessions.discard(sid)
+        if not sessions:
+            self.install_sessions.pop(install_id, None)
+            self.install_storage.pop(install_id, None)
+            self.last_values.pop(install_id, None)
+            if registry.is_created('openai'):
+                registry.get('openai').forget(install_id)
+            logger.debug(f"🧹 Instalación {install_id} liberada (sin sesiones)")
+
+    def _resolve_install(self, data: Optional[Dict[str, Any]]) -> Optional[str]:
+        """
+        Determina la instalación de la petición actual.
+        Si el payload trae installTimestamp la sesión se asocia a esa instalación.
+        """
+        sid = request.sid
+        install_id = (data or {}).get('installTimestamp')
+        if install_id:
+            self._bind_session(sid, install_id)
+        return self.session_installs.get(sid)
+
+    def _current_storage(self, data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Espacio de almacenamiento de la petición actual.
+        Las sesiones sin instalación usan un espacio privado que no se comparte.
+        """
+        install_id = self._resolve_install(data)
+        if install_id is not None:
+            return self.get_storage(install_id)
+        if request.sid not in self.session_storage:
+            self.session_storage[request.sid] = self._default_storage()
+        return self.session_storage[request.sid]
             
-    def _has_value_changed(self, key: str, new_value: Any) -> bool:
+    def _capture(self, event: str, data: Optional[Dict[str, Any]]):
+        """Graba el evento si la captura de tráfico está activa"""
+        if self.recorder is not None:
+            self.recorder.record(request.sid, event, data)
+
+    def _busy_response(self, event: str, retry_after: float, request_id: Optional[str]) -> Dict[str, Any]:
+        """Respuesta rápida cuando se descarta una petición por carga"""
+        logger.warning(f"🚦 Petición descartada ({event}), reintentar en {retry_after:.2f}s")
+        return {
+            'status': 'busy',
+            'error': 'busy',
+            'retry_after': round(retry_after, 3),
+            'request_id': request_id
+        }
+
+    def get_load_stats(self) -> Dict[str, Any]:
+        """Profundidad de la cola de búsqueda y contadores de admisión"""
+        return {
+            'admission': self.admission.stats(),
+            'search_queue': self.search_queue.stats()
+        }
+
+    @staticmethod
+    def _int_option(section: Dict[str, Any], name: str, default: int) -> int:
+        """Entero positivo de la configuración (acepta números y strings numéricos)"""
+        value = section.get(name, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f"{name} debe ser un entero")
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError(f"{name} debe ser un entero")
+        if value < 1:
+            raise ValueError(f"{name} debe ser mayor que 0")
+        return value
+
+    @classmethod
+    def _search_options(cls, config: Any) -> Dict[str, Any]:
+        """
+        Valida la configuración del cliente y la convierte en opciones del índice.
+        Raises:
+            ValueError: Si la configuración no tiene el formato esperado
+        """
+        if config is None:
+            config = {}
+        if not isinstance(config, dict):
+            raise ValueError("config debe ser un objeto")
+        sql_config = config.get('sql') or {}
+        search_config = config.get('search') or {}
+        filters = config.get('filters') or None
+        if not isinstance(sql_config, dict) or not isinstance(search_config, dict):
+            raise ValueError("config.sql y config.search deben ser objetos")
+        if filters is not None and not isinstance(filters, dict):
+            raise ValueError("config.filters debe ser un objeto")
+        return {
+            'limit': cls._int_option(sql_config, 'maxTotal', 150),
+            'filters': filters,
+            'max_keywords': cls._int_option(sql_config, 'maxKeywords', 10),
+            'strict': bool(sql_config.get('strictMode', False)),
+            # El rerank con OpenAI se activa con search.ontologyMode == 'openai'
+            'rerank': search_config.get('ontologyMode') == 'openai'
+        }
+
+    def _score_group(self, index, items: List[Dict[str, Any]], options: Dict[str, Any]) -> List[Any]:
+        """
+        Busca en el índice las búsquedas con las mismas opciones.
+        Si el lote falla se repite una a una para que el error solo afecte a su petición.
+        """
+        terms = [item['data']['term'] for item in items]
+        try:
+            return index.search_batch(terms, **options)
+        except Exception as e:
+            logger.error(f"Error en búsqueda por lotes, se reintenta una a una: {e}")
+        results = []
+        for term in terms:
+            try:
+                results.append(index.search_batch([term], **options)[0])
+            except Exception as e:
+                logger.error(f"Error procesando búsqueda: {e}")
+                results.append(e)
+        return results
+
+    def _rerank_install(self, install_id: str, queries: List[Dict[str, Any]]) -> Optional[List[Any]]:
+        """Rerank de las búsquedas de una instalación con su propio cliente OpenAI"""
+        try:
+            openai_service = registry.get('openai')
+            if not openai_service.ensure_client(self, install_id):
+                logger.warning("⚠️ Rerank omitido: instalación sin cliente OpenAI")
+                return None
+            return openai_service.rerank_batch(queries, install_id)
+        except Exception as e:
+            logger.error(f"❌ Error en rerank, se mantiene el orden local: {e}")
+            return None
+
+    def _search_batch(self, items: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Ejecuta un lote de búsquedas: las que comparten opciones van en una llamada al
+        índice y las que piden rerank se envían a OpenAI en prompts por lotes (uno por
+        instalación), que es lo que justifica vaciar la cola en lotes. Un error solo
+        afecta a las búsquedas que lo provocan.
+        Returns:
+            Por cada búsqueda, su resultado o la excepción que la hizo fallar
+        """
+        index = registry.get('loinc_index')
+        candidates: List[Any] = [[] for _ in items]
+
+        groups: Dict[str, List[int]] = {}
+        for position, item in enumerate(items):
+            options = {k: v for k, v in item['options'].items() if k != 'rerank'}
+            groups.setdefault(json.dumps(options, sort_keys=True, default=str), []).append(position)
+        for key, positions in groups.items():
+            ranked_group = self._score_group(index, [items[p] for p in positions], json.loads(key))
+            for position, ranked in zip(positions, ranked_group):
+                if isinstance(ranked, Exception):
+                    candidates[position] = ranked
+                else:
+                    candidates[position] = [index.result(doc_id, score) for doc_id, score in ranked]
+
+        reranked = set()
+        installs: Dict[str, List[int]] = {}
+        for position, item in enumerate(items):
+            if (item['options']['rerank'] and item.get('install') is not None
+                    and isinstance(candidates[position], list) and len(candidates[position]) > 1):
+                installs.setdefault(item['install'], []).append(position)
+        for install_id, positions in installs.items():
+            queries = [{'term': items[p]['data']['term'], 'candidates': candidates[p]} for p in positions]
+            ranked_install = self._rerank_install(install_id, queries)
+            for position, ranked in zip(positions, ranked_install or []):
+                candidates[position] = ranked
+                reranked.add(position)
+
+        return [candidates[position] if isinstance(candidates[position], Exception) else {
+            'term': item['data']['term'],
+            'config': item['data'].get('config'),
+            'results': candidates[position],
+            'reranked': position in reranked,
+            'message': 'Búsqueda recibida correctamente'
+        } for position, item in enumerate(items)]
+
+    def _search_error(self, sid: str, request_id: Optional[str], error: str):
+        """Envía el error de una búsqueda solo a la sesión que la pidió"""
+        self.socketio.emit('search.results', {
+            'status': 'error',
+            'error': error,
+            'request_id': request_id
+        }, to=sid)
+
+    def _process_search(self, items: List[Dict[str, Any]]):
+        """Procesa un lote de búsquedas de la cola y envía cada resultado a la sesión que la pidió"""
+        try:
+            results = self._search_batch(items)
+        except Exception as e:
+            # Fallo del propio lote (ej: índice no disponible): no depende de ninguna petición
+            logger.error(f"Error procesando búsquedas: {e}")
+            for item in items:
+                self._search_error(item['sid'], item['data'].get('request_id'), 'Search failed')
+            return
+
+        for item, data in zip(items, results):
+            if isinstance(data, Exception):
+                self._search_error(item['sid'], item['data'].get('request_id'), str(data))
+                continue
+            self.socketio.emit('search.results', {
+                'status': 'success',
+                'data': data,
+                'request_id': item['data'].get('request_id')
+            }, to=item['sid'])
+            logger.info(f"Resultados enviados para término: {data['term']}")
+
+    def _has_value_changed(self, scope: str, key: str, new_value: Any) -> bool:
         """Comprueba si el valor ha cambiado respecto al último almacenado"""
-        if key not in self.last_values:
+        last_values = self.last_values.get(scope, {})
+        if key not in last_values:
             return True
-        return self.last_values[key] != new_value
+        return last_values[key] != new_value
 
-    def _log_value_update(self, key: str, value: Any, request_id: str):
+    def _log_value_update(self, scope: str, key: str, value: Any, request_id: str):
         """Log formateado para actualizaciones de valores"""
-        if self._has_value_changed(key, value):
+        if self._has_value_changed(scope, key, value):
             # Si el valor ha cambiado, mostrar JSON completo y formateado
             formatted_json = json.dumps({
                 'key': key,
@@ -48,7 +345,7 @@ class WebSocketService:
                 'request_id': request_id
             }, indent=2)
             logger.info(f"📥 Nuevo valor recibido:\n{formatted_json}")
-            self.last_values[key] = value
+            self.last_values.setdefault(scope, {})[key] = value
         else:
             # Si no ha cambiado, mostrar versión simplificada
             logger.debug(f"📤 Solicitud set_value: key='{key}'")
@@ -57,37 +354,57 @@ class WebSocketService:
         @self.socketio.on('connect')
         def handle_connect(auth):
             logger.info("🔌 Cliente conectado")
+            self.connected_sids.add(request.sid)
+            # Si el cliente indica su instalación al conectar, unirlo a su sala
+            if isinstance(auth, dict) and auth.get('installTimestamp'):
+                self._bind_session(request.sid, auth['installTimestamp'])
             # No enviamos la master key en la conexión, esperamos el installTimestamp
             emit('connect_response', {'status': 'success'})
             
         @self.socketio.on('disconnect')
         def handle_disconnect():
             logger.info("🔌 Cliente desconectado")
+            sid = request.sid
+            self.connected_sids.discard(sid)
+            self._release_session(sid)
+            self.session_storage.pop(sid, None)
+            self.last_values.pop(self._session_key(sid), None)
+            self.admission.forget(sid)
             
         @self.socketio.on('encryption.get_master_key')
         def handle_get_master_key(data):
             """Maneja la solicitud de obtener la master key"""
             logger.info("Cliente solicitando master key")
             install_timestamp = data.get('installTimestamp')
+
+            admitted, retry_after = self.admission.admit(request.sid, 'encryption.get_master_key')
+            if not admitted:
+                emit('encryption.master_key',
+                     self._busy_response('encryption.get_master_key', retry_after, None))
+                return
             
             if not install_timestamp:
                 logger.error("❌ No se proporcionó installTimestamp")
                 emit('encryption.master_key', {'error': 'installTimestamp required'})
                 return
-                
-            master_key = encryption_service.get_key_for_install(install_timestamp)
+
+            if not self._bind_session(request.sid, install_timestamp):
+                emit('encryption.master_key', {'error': 'invalid installTimestamp'})
+                return
+            master_key = registry.get('encryption').get_key_for_install(install_timestamp)
             emit('encryption.master_key', {'key': master_key})
             logger.info("Master key enviada al cliente")
 
         @self.socketio.on('storage.get_value')
         def handle_get_value(data: Dict[str, Any]):
             """Maneja la solicitud de valor del localStorage"""
+            self._capture('storage.get_value', data)
             logger.info(f"📤 Enviando valor de: {data}")
             key = data.get('key')
             request_id = data.get('request_id')
             
             if key:
-                value = self.storage_data.get(key)
+                value = self._current_storage(data).get(key)
                 logger.info(f"📤 Enviando valor de: {key}")
                 emit('storage_value', {
                     'value': value,
@@ -103,6 +420,7 @@ class WebSocketService:
         @self.socketio.on('storage.set_value')
         def handle_set_value(data: Dict[str, Any]):
             """Maneja la solicitud de establecer un valor en localStorage"""
+            self._capture('storage.set_value', data)
             key = data.get('key')
             value = data.get('value')
             request_id = data.get('request_id')
@@ -119,11 +437,27 @@ class WebSocketService:
                 return
             
             if key and value is not None:
+                # El propio valor de installTimestamp identifica la instalación
+                if key == 'installTimestamp' and not self._bind_session(request.sid, value):
+                    emit('storage.value_set', {
+                        'status': 'error',
+                        'message': 'installTimestamp no válido',
+                        'request_id': request_id
+                    })
+                    return
+
+                storage = self._current_storage(data)
+                install_id = self.session_installs.get(request.sid)
+                scope = install_id if install_id is not None else self._session_key(request.sid)
+
                 # Log del valor recibido
-                self._log_value_update(key, value, request_id)
+                self._log_value_update(scope, key, value, request_id)
                 
                 # Actualizar cache local
-                self.storage_data[key] = value
+                storage[key] = value
+                # Una API key nueva invalida el cliente OpenAI creado con la anterior
+                if key == 'openaiApiKey' and install_id is not None and registry.is_created('openai'):
+                    registry.get('openai').forget(install_id)
                 logger.info(f"💾 Almacenado: {key}")
                 
                 # Confirmar al cliente original
@@ -133,13 +467,13 @@ class WebSocketService:
                     'request_id': request_id
                 })
                 
-                # Broadcast a todos los clientes excepto al emisor
-                emit('storage.value_updated', {
-                    'key': key,
-                    'value': value
-                }, broadcast=True, include_self=False)
-                
-                logger.debug(f"📡 Broadcast enviado: {key}")
+                # Broadcast solo a las sesiones de la misma instalación, excepto al emisor
+                if install_id is not None:
+                    emit('storage.value_updated', {
+                        'key': key,
+                        'value': value
+                    }, to=self._room_for(install_id), include_self=False)
+                    logger.debug(f"📡 Broadcast enviado: {key} (instalación {install_id})")
             else:
                 logger.error("❌ Key y value son requeridos")
                 emit('storage.value_set', {
@@ -151,12 +485,13 @@ class WebSocketService:
         @self.socketio.on('storage.get_all')
         def handle_get_all(data: Dict[str, Any]):
             """Maneja la solicitud de obtener todos los valores"""
+            self._capture('storage.get_all', data)
             logger.info("📤 Enviando todos los valores")
             request_id = data.get('request_id')
             
             # Enviar todos los valores almacenados
             emit('storage.all_values', {
-                'values': self.storage_data,
+                'values': self._current_storage(data),
                 'request_id': request_id
             })
             logger.info("Todos los valores enviados")
@@ -164,9 +499,9 @@ class WebSocketService:
         @self.socketio.on('search.perform')
         def handle_search(data: Dict[str, Any]):
             """Maneja las solicitudes de búsqueda"""
+            self._capture('search.perform', data)
             logger.info(f"Recibida solicitud de búsqueda: {data}")
             term = data.get('term')
-            config = data.get('config')
             request_id = data.get('request_id')
 
             if not term:
@@ -177,34 +512,41 @@ class WebSocketService:
                 })
                 return
 
+            # Validar la configuración antes de encolar: una petición mal formada no
+            # debe llegar al lote que comparte con otras sesiones
             try:
-                # Log de la configuración para debug
-                logger.debug(f"Configuración de búsqueda: {json.dumps(config, indent=2)}")
-                logger.debug(f"Término de búsqueda: {term}")
-
-                # TODO: Implementar la lógica de búsqueda aquí
-                # Por ahora, solo devolvemos un mensaje de prueba
-                results = {
-                    'term': term,
-                    'config': config,
-                    'results': [],
-                    'message': 'Búsqueda recibida correctamente'
-                }
-
-                emit('search.results', {
-                    'status': 'success',
-                    'data': results,
-                    'request_id': request_id
-                })
-                logger.info(f"Resultados enviados para término: {term}")
-
-            except Exception as e:
-                logger.error(f"Error procesando búsqueda: {e}")
+                if not isinstance(term, str):
+                    raise ValueError("term debe ser un string")
+                options = self._search_options(data.get('config'))
+            except ValueError as e:
+                logger.error(f"Error: configuración de búsqueda no válida: {e}")
                 emit('search.results', {
                     'status': 'error',
                     'error': str(e),
                     'request_id': request_id
                 })
+                return
+
+            admitted, retry_after = self.admission.admit(request.sid, 'search.perform')
+            if not admitted:
+                emit('search.results', self._busy_response('search.perform', retry_after, request_id))
+                return
+
+            # Mientras el warm-up carga el índice las búsquedas se rechazan como busy
+            if registry.warming:
+                emit('search.results', self._busy_response('search.perform', 1.0, request_id))
+                return
+
+            # Encolar la búsqueda; si la cola está llena se descarta en lugar de esperar
+            queued, retry_after = self.search_queue.submit({
+                'sid': request.sid,
+                'install': self._resolve_install(data),
+                'data': data,
+                'options': options
+            })
+            if not queued:
+                self.admission.record_shed('search.perform')
+                emit('search.results', self._busy_response('search.perform', retry_after, request_id))
 
     def run(self, host: str = '0.0.0.0', port: int = 5001):
         self.socketio.run(self.app, host=host, port=port) 
\ No newline at end of file
@@ -0,0 +1,78 @@
+import logging
+from flask import Flask
+from services.admission_service import TokenBucket, AdmissionController
+from services.websocket_service import WebSocketService
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+def test_token_bucket_refills_over_time():
+    """El bucket admite hasta su ráfaga y se recarga según su tasa"""
+    bucket = TokenBucket(rate=2, burst=2)
+    now = bucket.updated
+
+    assert bucket.try_acquire(now)[0]
+    assert bucket.try_acquire(now)[0]
+    allowed, retry_after = bucket.try_acquire(now)
+    assert not allowed
+    assert retry_after == 0.5
+
+    assert bucket.try_acquire(now + 0.5)[0]
+
+
+def test_global_limit_is_shared_between_connections():
+    """El límite global se aplica aunque cada conexión tenga tokens"""
+    admission = AdmissionController(per_connection_rate=1, per_connection_burst=5,
+                                    global_rate=1, global_burst=3)
+
+    results = [admission.admit(sid, 'search.perform')[0] for sid in ('a', 'b', 'c', 'd')]
+    assert results == [True, True, True, False]
+    assert admission.stats()['shed'] == {'search.perform': 1}
+
+    admission.forget('a')
+    assert admission.stats()['connections'] == 3
+
+
+def test_search_is_shed_when_connection_exceeds_its_budget():
+    """Una pestaña que envía demasiadas búsquedas recibe respuestas busy con retry_after"""
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+    websocket.admission = AdmissionController(per_connection_rate=1, per_connection_burst=2,
+                                              global_rate=100, global_burst=100)
+
+    client = websocket.socketio.test_client(app)
+    client.get_received()
+
+    logger.info("\n🔄 Enviando ráfaga de búsquedas...")
+    for i in range(4):
+        client.emit('search.perform', {'term': 'glucose', 'request_id': f'search_{i}'})
+    websocket.socketio.sleep(0.1)
+
+    results = {msg['args'][0]['request_id']: msg['args'][0]
+               for msg in client.get_received() if msg['name'] == 'search.results'}
+    assert results['search_0']['status'] == 'success'
+    assert results['search_1']['status'] == 'success'
+    assert results['search_2']['status'] == 'busy'
+    assert results['search_3']['retry_after'] > 0
+
+    stats = websocket.get_load_stats()
+    assert stats['admission']['shed'] == {'search.perform': 2}
+    assert stats['search_queue']['processed'] == 2
+    assert stats['search_queue']['depth'] == 0
+
+
+def test_queued_searches_of_disconnected_client_are_skipped():
+    """Las búsquedas encoladas de un cliente que se desconecta no consumen workers"""
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+
+    client = websocket.socketio.test_client(app)
+    for i in range(3):
+        client.emit('search.perform', {'term': 'glucose', 'request_id': f'search_{i}'})
+    client.disconnect()
+    websocket.socketio.sleep(0.1)
+
+    stats = websocket.get_load_stats()['search_queue']
+    assert stats['skipped'] == 3
+    assert stats['processed'] == 0
@@ -0,0 +1,119 @@
+import csv
+import gzip
+import json
+import logging
+import pytest
+from flask import Flask
+from services.registry import registry
+from services.loinc_index import LoincIndex, LOINC_COLUMNS
+from services import export_service
+from routes.export import export_bp
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+LOINC_ROWS = [
+    ('2345-7', 'Glucose', 'MCnc', 'Pt', 'Ser/Plas', 'Qn', '', 'CHEM', 'Glucose [Mass/volume] in Serum or Plasma'),
+    ('2339-0', 'Glucose', 'MCnc', 'Pt', 'Bld', 'Qn', '', 'CHEM', 'Glucose [Mass/volume] in Blood'),
+    ('718-7', 'Hemoglobin', 'MCnc', 'Pt', 'Bld', 'Qn', '', 'HEM/BC', 'Hemoglobin [Mass/volume] in Blood'),
+    ('2160-0', 'Creatinine', 'MCnc', 'Pt', 'Ser/Plas', 'Qn', '', 'CHEM', 'Creatinine [Mass/volume] in Serum or Plasma'),
+]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Cliente HTTP de una app mínima con el blueprint de exportación y un índice LOINC pequeño"""
+    loinc_path = tmp_path / 'Loinc.csv'
+    with open(loinc_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(LOINC_COLUMNS)
+        writer.writerows(LOINC_ROWS)
+    monkeypatch.setitem(registry._instances, 'loinc_index', LoincIndex.from_csv(str(loinc_path)))
+
+    app = Flask(__name__)
+    app.register_blueprint(export_bp)
+    return app.test_client()
+
+
+def test_export_mapping_as_csv(client):
+    """Un mapeo de varios términos se exporta como CSV con término, posición y score"""
+    response = client.post('/export', json={'terms': ['glucose blood', 'hemoglobin'], 'limit': 2})
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers['Content-Disposition'] == 'attachment; filename=loinc_export.csv'
+    rows = list(csv.DictReader(response.get_data(as_text=True).splitlines()))
+    assert [(r['term'], r['rank'], r['LOINC_NUM']) for r in rows] == [
+        ('glucose blood', '1', '2339-0'),
+        ('glucose blood', '2', '2345-7'),
+        ('hemoglobin', '1', '718-7'),
+    ]
+
+
+def test_export_full_index_as_gzip_ndjson(client):
+    """Sin términos se exporta el índice filtrado por facetas, en NDJSON comprimido"""
+    response = client.get('/export?format=ndjson&gzip=1&system=Ser/Plas')
+
+    assert response.mimetype == 'application/gzip'
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert [json.loads(line)['LOINC_NUM'] for line in lines] == ['2345-7', '2160-0']
+
+
+def test_export_single_term_in_json_body(client):
+    """Un POST con 'term' exporta el mapeo de ese término"""
+    response = client.post('/export', json={'term': 'hemoglobin', 'format': 'ndjson'})
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert [(json.loads(line)['term'], json.loads(line)['LOINC_NUM']) for line in lines] == [
+        ('hemoglobin', '718-7')
+    ]
+
+
+def test_export_repeated_terms_in_query_string(client):
+    """'terms' y 'term' se pueden repetir en la query string"""
+    response = client.get('/export?terms=hemoglobin&terms=creatinine&term=glucose+serum&limit=1')
+
+    rows = list(csv.DictReader(response.get_data(as_text=True).splitlines()))
+    assert [(r['term'], r['LOINC_NUM']) for r in rows] == [
+        ('glucose serum', '2345-7'),
+        ('hemoglobin', '718-7'),
+        ('creatinine', '2160-0'),
+    ]
+
+
+def test_export_rejects_unknown_format(client):
+    response = client.get('/export?format=xlsx')
+    assert response.status_code == 400
+
+
+def test_export_rejects_invalid_json(client):
+    """Un cuerpo que no es un objeto o términos que no son strings devuelven 400"""
+    assert client.post('/export', json=['glucose']).status_code == 400
+    assert client.post('/export', json={'terms': ['glucose', 7]}).status_code == 400
+    assert client.post('/export', json={'term': {'text': 'glucose'}}).status_code == 400
+
+
+def test_export_streams_in_batches(monkeypatch):
+    """Las filas se serializan por fragmentos en lugar de construir todo el payload"""
+    monkeypatch.setattr(export_service, 'EXPORT_BATCH_ROWS', 100)
+    rows = ({'LOINC_NUM': f'{i}-0'} for i in range(1000))
+
+    chunks = list(export_service.iter_export(rows, LOINC_COLUMNS, 'csv'))
+    assert len(chunks) == 11
+    assert sum(chunk.count('\n') for chunk in chunks) == 1001
+
+
+def test_export_mapping_searches_terms_in_batches(client, monkeypatch):
+    """El mapeo busca los términos por lotes con search_batch y conserva su orden"""
+    index = registry.get('loinc_index')
+    calls = []
+    search_batch = index.search_batch
+    monkeypatch.setattr(index, 'search_batch', lambda terms, **kw: calls.append(terms) or search_batch(terms, **kw))
+    monkeypatch.setattr(export_service, 'EXPORT_BATCH_TERMS', 2)
+
+    terms = ['hemoglobin', 'creatinine', 'glucose serum']
+    rows = list(export_service.iter_export_rows(index, terms, limit=1))
+    assert calls == [['hemoglobin', 'creatinine'], ['glucose serum']]
+    assert [(r['term'], r['LOINC_NUM']) for r in rows] == [
+        ('hemoglobin', '718-7'), ('creatinine', '2160-0'), ('glucose serum', '2345-7')
+    ]
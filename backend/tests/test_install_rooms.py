@@ -0,0 +1,125 @@
+import logging
+from flask import Flask
+from services.websocket_service import WebSocketService
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _received(client, event):
+    """Devuelve los payloads recibidos por un cliente para un evento"""
+    return [msg['args'][0] for msg in client.get_received() if msg['name'] == event]
+
+
+def test_storage_is_isolated_per_install():
+    """Cada instalación tiene su propio searchConfig y sus broadcasts no salen de su sala"""
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+
+    tab_a1 = websocket.socketio.test_client(app, auth={'installTimestamp': 'install-a'})
+    tab_a2 = websocket.socketio.test_client(app, auth={'installTimestamp': 'install-a'})
+    tab_b = websocket.socketio.test_client(app, auth={'installTimestamp': 'install-b'})
+    for client in (tab_a1, tab_a2, tab_b):
+        client.get_received()
+
+    logger.info("\n🔄 Guardando configuración en la instalación A...")
+    tab_a1.emit('storage.set_value', {
+        'key': 'searchConfig',
+        'value': {'search': {'dbMode': 'sql'}},
+        'request_id': 'set_a'
+    })
+
+    assert _received(tab_a1, 'storage.value_set')[0]['status'] == 'success'
+    assert _received(tab_a2, 'storage.value_updated') == [
+        {'key': 'searchConfig', 'value': {'search': {'dbMode': 'sql'}}}
+    ]
+    assert _received(tab_b, 'storage.value_updated') == []
+
+    logger.info("\n🔍 Verificando que la instalación B no ve la configuración de A...")
+    tab_b.emit('storage.get_value', {'key': 'searchConfig', 'request_id': 'get_b'})
+    assert _received(tab_b, 'storage_value')[0]['value'] == {}
+
+    tab_a2.emit('storage.get_all', {'request_id': 'all_a'})
+    values = _received(tab_a2, 'storage.all_values')[0]['values']
+    assert values['searchConfig'] == {'search': {'dbMode': 'sql'}}
+    assert values['installTimestamp'] == 'install-a'
+
+
+def test_session_binds_to_install_from_payload():
+    """Los valores guardados antes de conocer la instalación se trasladan a su espacio"""
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+
+    client = websocket.socketio.test_client(app)
+    client.emit('storage.set_value', {
+        'key': 'searchConfig',
+        'value': {'sql': {'maxKeywords': 10}},
+        'request_id': 'set_config'
+    })
+    assert websocket.session_installs == {}
+
+    client.emit('storage.set_value', {
+        'key': 'installTimestamp',
+        'value': 'install-c',
+        'request_id': 'set_timestamp'
+    })
+
+    storage = websocket.get_storage('install-c')
+    assert storage['searchConfig'] == {'sql': {'maxKeywords': 10}}
+    assert list(websocket.install_storage) == ['install-c']
+
+    client.disconnect()
+    assert websocket.session_installs == {}
+
+
+def test_install_storage_is_released_when_last_session_leaves():
+    """El espacio de una instalación se libera al desconectarse su última sesión"""
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+
+    tab_1 = websocket.socketio.test_client(app, auth={'installTimestamp': 'install-d'})
+    tab_2 = websocket.socketio.test_client(app, auth={'installTimestamp': 'install-d'})
+    tab_1.emit('storage.set_value', {'key': 'searchConfig', 'value': {'sql': {}}, 'request_id': 'set'})
+
+    tab_1.disconnect()
+    assert websocket.install_storage['install-d']['searchConfig'] == {'sql': {}}
+
+    tab_2.disconnect()
+    assert websocket.install_storage == {}
+    assert websocket.install_sessions == {}
+    assert websocket.last_values == {}
+
+
+def test_rebinding_releases_previous_install():
+    """Cambiar de instalación libera la anterior si no le quedan sesiones"""
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+
+    client = websocket.socketio.test_client(app, auth={'installTimestamp': 'install-e'})
+    client.emit('storage.get_all', {'installTimestamp': 'install-f', 'request_id': 'all'})
+
+    assert list(websocket.install_storage) == ['install-f']
+    assert list(websocket.install_sessions) == ['install-f']
+
+
+def test_install_id_cannot_reach_session_storage():
+    """Un installTimestamp con el prefijo de sesión no da acceso al espacio privado de otra sesión"""
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+
+    victim = websocket.socketio.test_client(app)
+    victim.emit('storage.set_value', {'key': 'openaiApiKey', 'value': 'cifrada', 'request_id': 'set'})
+    victim_sid = next(iter(websocket.session_storage))
+
+    attacker = websocket.socketio.test_client(app)
+    attacker.get_received()
+    attacker.emit('storage.get_all', {'installTimestamp': f'session:{victim_sid}', 'request_id': 'all'})
+    assert _received(attacker, 'storage.all_values')[0]['values']['openaiApiKey'] is None
+
+    attacker.emit('storage.set_value', {'key': 'installTimestamp', 'value': f'session:{victim_sid}',
+                                        'request_id': 'bind'})
+    assert _received(attacker, 'storage.value_set')[0]['status'] == 'error'
+    attacker.disconnect()
+
+    assert websocket.session_storage[victim_sid]['openaiApiKey'] == 'cifrada'
+    assert websocket.session_installs == {}
@@ -0,0 +1,67 @@
+import logging
+import pytest
+from services.loinc_index import LoincIndex
+from tools.benchmark_search import synthetic_index, sample_queries
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture(scope='module')
+def index():
+    index = synthetic_index(3000)
+    index.build_matrix()
+    return index
+
+
+def _assert_same_ranking(expected, actual):
+    assert [doc_id for doc_id, _ in actual] == [doc_id for doc_id, _ in expected]
+    for (_, a), (_, b) in zip(expected, actual):
+        assert a == pytest.approx(b, abs=1e-9)
+
+
+@pytest.mark.parametrize('options', [
+    {'limit': 10},
+    {'limit': 25, 'strict': True},
+    {'limit': None, 'max_keywords': 3},
+    {'limit': 10, 'filters': {'system': 'Bld', 'scale': ['Qn', 'Ord']}},
+    {'limit': 5, 'filters': {'class': 'CHEM'}, 'strict': True},
+])
+def test_vectorized_search_matches_python(index, options):
+    """El ranking vectorizado sobre la matriz CSR coincide con la referencia en Python"""
+    for query in sample_queries(index, 40, 10):
+        _assert_same_ranking(index.search_python(query, **options), index.search(query, **options))
+
+
+def test_batch_search_matches_single_queries(index):
+    """Buscar un lote de consultas da los mismos resultados que una a una"""
+    queries = sample_queries(index, 30, 10) + ['', 'palabrainexistente glucose']
+
+    batch = index.search_batch(queries, limit=10, strict=True)
+    assert len(batch) == len(queries)
+    for query, results in zip(queries, batch):
+        _assert_same_ranking(index.search_python(query, limit=10, strict=True), results)
+
+
+def test_matrix_is_rebuilt_after_adding_rows():
+    """Añadir filas invalida la matriz y el nuevo documento aparece en la búsqueda"""
+    index = LoincIndex()
+    index.add_rows([{'LOINC_NUM': '2345-7', 'LONG_COMMON_NAME': 'Glucose in Serum'}])
+    assert index.search('glucose')[0][0] == 0
+
+    index.add_rows([{'LOINC_NUM': '2339-0', 'LONG_COMMON_NAME': 'Glucose in Blood'}])
+    assert [doc_id for doc_id, _ in index.search('glucose blood')] == [1, 0]
+
+
+def test_unknown_facet_values_are_not_cached():
+    """Los valores de faceta que no existen no añaden entradas a la caché de máscaras"""
+    index = LoincIndex()
+    index.add_rows([
+        {'LOINC_NUM': '2345-7', 'SYSTEM': 'Ser/Plas', 'LONG_COMMON_NAME': 'Glucose in Serum'},
+        {'LOINC_NUM': '2339-0', 'SYSTEM': 'Bld', 'LONG_COMMON_NAME': 'Glucose in Blood'},
+    ])
+
+    assert [doc_id for doc_id, _ in index.search('glucose', filters={'system': ['Bld', 'nada']})] == [1]
+    for i in range(100):
+        assert index.search('glucose', filters={'system': f'desconocido-{i}'}) == []
+    assert list(index._facet_masks) == [('SYSTEM', 'bld')]
@@ -38,15 +38,13 @@ def test_openai_service():
     logger.info(f"\n🔒 API Key encriptada: {encrypted_key}")
     
     # Establecer datos en el WebSocket
-    websocket.storage_data = {
-        'openai_api_key': encrypted_key,
-        'installTimestamp': install_timestamp
-    }
+    storage_data = websocket.get_storage(install_timestamp)
+    storage_data['openai_api_key'] = encrypted_key
     
     # Verificar datos necesarios
     logger.info("\n🔍 Verificando datos del WebSocket...")
     required_keys = ['openai_api_key', 'installTimestamp']
-    missing_keys = [key for key in required_keys if key not in websocket.storage_data]
+    missing_keys = [key for key in required_keys if not storage_data.get(key)]
     
     if missing_keys:
         pytest.fail(f"❌ Faltan datos en el WebSocket: {missing_keys}")
@@ -57,7 +55,7 @@ def test_openai_service():
     
     # Inicializar servicio
     logger.info("\n🔄 Inicializando servicio OpenAI...")
-    success = openai.initialize(websocket)
+    success = openai.initialize(websocket, install_timestamp)
     
     if not success:
         pytest.fail("❌ Error inicializando servicio OpenAI")
@@ -69,7 +67,7 @@ def test_openai_service():
     
     # Probar conexión
     logger.info("\n🔄 Probando conexión con OpenAI...")
-    result = openai.test_connection()
+    result = openai.test_connection(install_timestamp)
     
     if result['status'] != 'success':
         pytest.fail(f"❌ Error probando conexión OpenAI: {result['message']}")
@@ -0,0 +1,127 @@
+import os
+import sys
+import logging
+import subprocess
+from services.registry import ServiceRegistry
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+def test_services_are_built_lazily():
+    """Importar el servicio WebSocket no construye servicios ni importa el SDK de OpenAI"""
+    # En un proceso aparte para no depender de lo que hayan importado otros tests
+    code = (
+        "import sys, services.websocket_service\n"
+        "from services.registry import registry\n"
+        "assert 'openai' not in sys.modules\n"
+        "assert not registry.is_created('encryption')\n"
+        "assert not registry.is_created('loinc_index')\n"
+    )
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=backend_dir,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_warm_up_in_os_thread_does_not_block_hub():
+    """Con eventlet, el warm-up en tpool deja al hub atender y get() espera sin bloquearlo"""
+    code = (
+        "import eventlet\n"
+        "eventlet.monkey_patch()\n"
+        "import time\n"
+        "from eventlet import tpool\n"
+        "from services.registry import ServiceRegistry\n"
+        "registry = ServiceRegistry()\n"
+        "def build():\n"
+        "    end = time.monotonic() + 0.5\n"
+        "    while time.monotonic() < end:\n"
+        "        pass\n"
+        "    return 'index'\n"
+        "registry.register('index', build)\n"
+        "registry.add_warmup('index', lambda: registry.get('index'))\n"
+        "ticks = []\n"
+        "def tick():\n"
+        "    for _ in range(4):\n"
+        "        ticks.append(registry.ready)\n"
+        "        eventlet.sleep(0.05)\n"
+        "warm = eventlet.spawn(tpool.execute, registry.warm_up)\n"
+        "eventlet.spawn(tick)\n"
+        "eventlet.sleep(0.02)\n"
+        "assert registry.get('index') == 'index'\n"
+        "assert warm.wait() and registry.ready\n"
+        "assert ticks == [False] * 4, ticks\n"
+    )
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=backend_dir,
+                            capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr
+
+
+def test_warm_up_marks_registry_ready():
+    """El registro solo está listo cuando todas las etapas de warm-up terminan"""
+    local_registry = ServiceRegistry()
+    created = []
+    local_registry.register('cache', lambda: created.append('cache') or {})
+    local_registry.add_warmup('fill_cache', lambda: local_registry.get('cache').update(hot=True))
+
+    assert created == []
+    assert not local_registry.status()['ready']
+
+    assert local_registry.warm_up()
+    assert created == ['cache']
+    assert local_registry.get('cache') == {'hot': True}
+    assert local_registry.status()['stages'].keys() == {'fill_cache'}
+
+
+def test_failed_warm_up_is_not_ready():
+    """Un error en una etapa deja el registro sin marcar como listo"""
+    local_registry = ServiceRegistry()
+
+    def broken_stage():
+        raise RuntimeError('índice no disponible')
+
+    local_registry.add_warmup('index', broken_stage)
+
+    assert not local_registry.warm_up()
+    assert local_registry.status()['errors'] == {'index': 'índice no disponible'}
+
+
+def test_encryption_keys_are_pre_derived(monkeypatch):
+    """El warm-up pre-deriva las master keys de las instalaciones conocidas"""
+    monkeypatch.setenv('SALT_MASTER_KEY', '00' * 16)
+    monkeypatch.setenv('WARMUP_INSTALLS', '1700000000000, 1700000000001')
+    from services.encryption_service import EncryptionService
+    local_registry = ServiceRegistry()
+    local_registry.register('encryption', EncryptionService)
+    monkeypatch.setattr('services.registry.registry', local_registry)
+    from services.registry import _warm_encryption_keys
+    local_registry.add_warmup('encryption_keys', _warm_encryption_keys)
+
+    assert local_registry.warm_up()
+    assert set(local_registry.get('encryption').install_keys) == {'1700000000000', '1700000000001'}
+
+
+def test_loinc_index_warm_up_maps_matrix(tmp_path, monkeypatch):
+    """El warm-up del índice mapea la matriz CSR en memoria y precalcula las máscaras"""
+    import numpy as np
+    from services.registry import _warm_loinc_index
+    from tools.benchmark_search import synthetic_index
+
+    index = synthetic_index(500)
+    expected = index.search_python('glucose blood', limit=10)
+    monkeypatch.setenv('LOINC_MATRIX_DIR', str(tmp_path / 'matrix'))
+    local_registry = ServiceRegistry()
+    local_registry.register('loinc_index', lambda: index)
+    monkeypatch.setattr('services.registry.registry', local_registry)
+    local_registry.add_warmup('loinc_index', _warm_loinc_index)
+
+    assert local_registry.warm_up()
+    assert isinstance(index.weights, np.memmap)
+    assert ('SYSTEM', 'bld') in index._facet_masks
+    assert index.search('glucose blood', limit=10) == expected
+
+    # Una segunda instancia reutiliza los ficheros ya generados
+    other = synthetic_index(500)
+    assert other.load_matrix(str(tmp_path / 'matrix'))
+    assert other.search('glucose blood', limit=10) == expected
@@ -0,0 +1,236 @@
+import json
+import logging
+from types import SimpleNamespace
+from flask import Flask
+from services.registry import registry
+from services.loinc_index import LoincIndex
+from services.openai_service import OpenAIService
+from services.websocket_service import WebSocketService
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+class FakeCompletions:
+    """Sustituto de client.chat.completions que invierte el orden de cada consulta"""
+
+    def __init__(self):
+        self.calls = []
+
+    def create(self, model, messages, **kwargs):
+        prompt = messages[-1]['content']
+        self.calls.append(prompt)
+        results = []
+        for block in prompt.split('\n\n'):
+            lines = block.split('\n')
+            query = int(lines[0].split(':')[0][1:])
+            codes = [line[2:].split(' | ')[0] for line in lines[1:]]
+            results.append({'query': query, 'ranking': list(reversed(codes)) + ['99999-9']})
+        content = '```json\n' + json.dumps({'results': results}) + '\n```'
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+INSTALL = 'install-r'
+
+
+def _service():
+    """Servicio OpenAI con un cliente falso para la instalación INSTALL"""
+    service = OpenAIService()
+    completions = FakeCompletions()
+    service.clients[INSTALL] = ('cifrada', SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    return service, completions
+
+
+def _candidates(*codes):
+    return [{'code': code, 'name': f'Nombre {code}'} for code in codes]
+
+
+def test_rerank_batches_queries_in_one_prompt():
+    """Varias consultas se reordenan con una sola llamada y sin códigos inventados"""
+    service, completions = _service()
+
+    results = service.rerank_batch([
+        {'term': 'glucosa', 'candidates': _candidates('2345-7', '2339-0', '41653-7')},
+        {'term': 'hemoglobina', 'candidates': _candidates('718-7', '20509-6')},
+    ], INSTALL)
+
+    assert len(completions.calls) == 1
+    assert [c['code'] for c in results[0]] == ['41653-7', '2339-0', '2345-7']
+    assert [c['code'] for c in results[1]] == ['20509-6', '718-7']
+
+
+def test_rerank_results_are_cached_by_term_candidates_and_model():
+    """El mismo término y conjunto de candidatos no vuelve a llamar al modelo"""
+    service, completions = _service()
+    candidates = _candidates('2345-7', '2339-0')
+
+    service.rerank('glucosa', candidates, INSTALL)
+    cached = service.rerank('glucosa', list(reversed(candidates)), INSTALL)
+    assert len(completions.calls) == 1
+    assert [c['code'] for c in cached] == ['2339-0', '2345-7']
+
+    service.set_model('gpt-4o-mini')
+    service.rerank('glucosa', candidates, INSTALL)
+    assert len(completions.calls) == 2
+
+
+def test_rerank_respects_token_budget_and_top_k():
+    """Las consultas se reparten en lotes bajo el presupuesto y solo se envían los top-k"""
+    service, completions = _service()
+    service.rerank_top_k = 3
+    service.rerank_token_budget = 150
+
+    queries = [{'term': f'termino {i}', 'candidates': _candidates(*[f'{i}{j}-0' for j in range(5)])}
+               for i in range(6)]
+    results = service.rerank_batch(queries, INSTALL)
+
+    assert len(completions.calls) > 1
+    for prompt in completions.calls:
+        assert service._estimate_tokens(service._rerank_prompt_header() + prompt) <= 150
+    assert [c['code'] for c in results[0]] == ['02-0', '01-0', '00-0', '03-0', '04-0']
+
+
+def test_rerank_keeps_local_order_without_client():
+    """Sin cliente de la instalación se devuelve el orden local, aunque otra tenga cliente"""
+    service, completions = _service()
+    candidates = _candidates('2345-7', '2339-0')
+    assert service.rerank('glucosa', candidates, 'otra-instalacion') == candidates
+    assert completions.calls == []
+    assert service.test_connection('otra-instalacion')['status'] == 'error'
+
+
+def test_client_is_recreated_when_api_key_changes(monkeypatch):
+    """El cliente se crea de nuevo si la key cambia y se descarta al liberar la instalación"""
+    service, _ = _service()
+    monkeypatch.setitem(registry._instances, 'openai', service)
+    initialized = []
+
+    def initialize(websocket_service, install_timestamp):
+        initialized.append(install_timestamp)
+        service.clients[install_timestamp] = (service.stored_key(websocket_service, install_timestamp), object())
+        return True
+
+    monkeypatch.setattr(service, 'initialize', initialize)
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+    client = websocket.socketio.test_client(app, auth={'installTimestamp': INSTALL})
+
+    client.emit('storage.set_value', {'key': 'openaiApiKey', 'value': 'cifrada', 'request_id': 'k1'})
+    assert INSTALL not in service.clients
+    assert service.ensure_client(websocket, INSTALL)
+    assert service.ensure_client(websocket, INSTALL)
+    assert initialized == [INSTALL]
+
+    websocket.get_storage(INSTALL)['openaiApiKey'] = 'rotada'
+    assert service.ensure_client(websocket, INSTALL)
+    assert initialized == [INSTALL, INSTALL]
+    assert service.clients[INSTALL][0] == 'rotada'
+
+    client.disconnect()
+    assert service.clients == {}
+
+
+def test_rerank_max_tokens_fits_json_response():
+    """El límite de salida cubre la respuesta JSON completa con códigos entre comillas"""
+    service, _ = _service()
+    batch = [{'term': f'termino {i}', 'candidates': _candidates(*[f'{i}{j:04d}-{j % 10}' for j in range(20)])}
+             for i in range(3)]
+    response = json.dumps({'results': [
+        {'query': i, 'ranking': [c['code'] for c in query['candidates']]} for i, query in enumerate(batch)
+    ]}, indent=2)
+
+    assert service._rerank_max_tokens(batch) >= len(response) // 3
+
+
+def _small_index():
+    index = LoincIndex()
+    index.add_rows([
+        {'LOINC_NUM': '2345-7', 'COMPONENT': 'Glucose', 'SYSTEM': 'Ser/Plas',
+         'LONG_COMMON_NAME': 'Glucose [Mass/volume] in Serum or Plasma'},
+        {'LOINC_NUM': '2339-0', 'COMPONENT': 'Glucose', 'SYSTEM': 'Bld',
+         'LONG_COMMON_NAME': 'Glucose [Mass/volume] in Blood'},
+        {'LOINC_NUM': '718-7', 'COMPONENT': 'Hemoglobin', 'SYSTEM': 'Bld',
+         'LONG_COMMON_NAME': 'Hemoglobin [Mass/volume] in Blood'},
+    ])
+    return index
+
+
+def _batched_websocket(monkeypatch, service):
+    """Servicio WebSocket con un solo worker que atiende la cola en lotes"""
+    monkeypatch.setitem(registry._instances, 'loinc_index', _small_index())
+    monkeypatch.setitem(registry._instances, 'openai', service)
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+    websocket.search_queue.workers = 1
+    websocket.search_queue.batch_size = 8
+    websocket.get_storage(INSTALL)['openaiApiKey'] = 'cifrada'
+    return app, websocket
+
+
+def test_queued_searches_are_reranked_in_one_prompt(monkeypatch):
+    """Las búsquedas encoladas con ontologyMode 'openai' se reordenan en un único prompt por lote"""
+    service, completions = _service()
+    app, websocket = _batched_websocket(monkeypatch, service)
+    client = websocket.socketio.test_client(app, auth={'installTimestamp': INSTALL})
+    client.get_received()
+
+    config = {'search': {'ontologyMode': 'openai'}}
+    for i, term in enumerate(['glucose', 'blood', 'glucose serum']):
+        client.emit('search.perform', {'term': term, 'config': config, 'request_id': f'search_{i}'})
+    client.emit('search.perform', {'term': 'glucose', 'request_id': 'search_local'})
+    websocket.socketio.sleep(0.1)
+
+    results = {msg['args'][0]['request_id']: msg['args'][0]['data']
+               for msg in client.get_received() if msg['name'] == 'search.results'}
+    assert len(completions.calls) == 1
+    assert all(results[f'search_{i}']['reranked'] for i in range(3))
+    assert not results['search_local']['reranked']
+    assert [r['code'] for r in results['search_1']['results']] == ['718-7', '2339-0']
+
+
+def test_invalid_search_does_not_fail_the_batch(monkeypatch):
+    """Una búsqueda mal formada se rechaza sola y no afecta a la de otra instalación del lote"""
+    service, _ = _service()
+    app, websocket = _batched_websocket(monkeypatch, service)
+    tab_a = websocket.socketio.test_client(app, auth={'installTimestamp': INSTALL})
+    tab_b = websocket.socketio.test_client(app, auth={'installTimestamp': 'install-b'})
+    for client in (tab_a, tab_b):
+        client.get_received()
+
+    tab_b.emit('search.perform', {'term': 'glucose', 'config': {'sql': {'maxTotal': 'lots'}},
+                                  'request_id': 'bad_total'})
+    tab_b.emit('search.perform', {'term': 'glucose', 'config': 'sql', 'request_id': 'bad_config'})
+    tab_a.emit('search.perform', {'term': 'glucose', 'config': {'sql': {'maxTotal': '5'}},
+                                  'request_id': 'good'})
+    websocket.socketio.sleep(0.1)
+
+    results_b = {msg['args'][0]['request_id']: msg['args'][0]
+                 for msg in tab_b.get_received() if msg['name'] == 'search.results'}
+    results_a = [msg['args'][0] for msg in tab_a.get_received() if msg['name'] == 'search.results']
+    assert results_b['bad_total']['status'] == 'error'
+    assert results_b['bad_config']['status'] == 'error'
+    assert [r['status'] for r in results_a] == ['success']
+    assert [r['code'] for r in results_a[0]['data']['results']] == ['2339-0', '2345-7']
+
+
+def test_failing_search_group_only_fails_its_own_requests(monkeypatch):
+    """Si el índice falla con un término, el resto del lote recibe sus resultados"""
+    service, _ = _service()
+    app, websocket = _batched_websocket(monkeypatch, service)
+    index = registry.get('loinc_index')
+    search_batch = index.search_batch
+
+    def flaky_search_batch(terms, **options):
+        if 'boom' in terms:
+            raise RuntimeError('fallo del índice')
+        return search_batch(terms, **options)
+
+    monkeypatch.setattr(index, 'search_batch', flaky_search_batch)
+    items = [{'sid': 'a', 'install': INSTALL, 'data': {'term': 'glucose'},
+              'options': websocket._search_options(None)},
+             {'sid': 'b', 'install': 'install-b', 'data': {'term': 'boom'},
+              'options': websocket._search_options(None)}]
+    results = websocket._search_batch(items)
+
+    assert [r['code'] for r in results[0]['results']] == ['2339-0', '2345-7']
+    assert isinstance(results[1], RuntimeError)
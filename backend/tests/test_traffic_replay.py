@@ -0,0 +1,123 @@
+import logging
+from flask import Flask
+from services.registry import registry
+from services.loinc_index import LoincIndex
+from services.openai_service import OpenAIService
+from services.websocket_service import WebSocketService
+from services.traffic_capture import TrafficRecorder, read_traffic, REDACTED
+from tools.replay_traffic import InProcessTarget, install_fake_openai, replay, result_drift
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _record_session(log_path, monkeypatch, config=None):
+    """Graba una sesión típica del frontend en log_path"""
+    monkeypatch.setenv('TRAFFIC_CAPTURE_PATH', str(log_path))
+    app = Flask(__name__)
+    websocket = WebSocketService(app)
+    client = websocket.socketio.test_client(app)
+
+    client.emit('storage.set_value', {'key': 'installTimestamp', 'value': '1700000000000',
+                                      'installTimestamp': '1700000000000', 'request_id': 'req_0'})
+    client.emit('storage.set_value', {'key': 'openaiApiKey', 'value': 'sk-secreto',
+                                      'installTimestamp': '1700000000000', 'request_id': 'req_1'})
+    for i, term in enumerate(['glucosa', 'hemoglobina', 'creatinina']):
+        client.emit('search.perform', {'term': term, 'config': config or {'sql': {'maxKeywords': 10}},
+                                       'request_id': f'search_{i}'})
+    client.emit('storage.get_all', {'request_id': 'req_2'})
+    websocket.recorder.close()
+
+
+def test_capture_redacts_secrets(tmp_path, monkeypatch):
+    """El log guarda eventos, tiempos y configs sin API keys ni installTimestamp en claro"""
+    log_path = tmp_path / 'traffic.ndjson'
+    _record_session(log_path, monkeypatch)
+
+    events = list(read_traffic(str(log_path)))
+    assert [e['e'] for e in events] == ['storage.set_value'] * 2 + ['search.perform'] * 3 + ['storage.get_all']
+    assert events[1]['d']['value'] == REDACTED
+    assert events[2]['d']['config'] == {'sql': {'maxKeywords': 10}}
+    assert events[2]['d']['request_id'] == 'search_0'
+    assert 'sk-secreto' not in log_path.read_text()
+    assert '1700000000000' not in log_path.read_text()
+    assert events[0]['t'] <= events[-1]['t']
+
+
+def test_pseudonyms_are_keyed_per_recording(tmp_path):
+    """Los seudónimos son estables dentro de un log pero no son un hash sin clave"""
+    import hashlib
+
+    logs = []
+    for name in ('a.ndjson', 'b.ndjson'):
+        recorder = TrafficRecorder(str(tmp_path / name))
+        for request_id in ('req_0', 'req_1'):
+            recorder.record('sid', 'storage.get_all', {'installTimestamp': '1700000000000',
+                                                       'request_id': request_id})
+        recorder.close()
+        logs.append(list(read_traffic(str(tmp_path / name))))
+
+    first, second = logs
+    assert first[0]['d']['installTimestamp'] == first[1]['d']['installTimestamp']
+    assert first[0]['s'] == first[1]['s']
+    assert first[0]['d']['installTimestamp'] != second[0]['d']['installTimestamp']
+    assert not hashlib.sha256(b'1700000000000').hexdigest().startswith(first[0]['d']['installTimestamp'])
+
+
+def test_replay_in_process_reports_latency_and_drift(tmp_path, monkeypatch):
+    """La reproducción en proceso contesta todas las peticiones y calcula la deriva"""
+    log_path = tmp_path / 'traffic.ndjson.gz'
+    _record_session(log_path, monkeypatch)
+    monkeypatch.delenv('TRAFFIC_CAPTURE_PATH')
+
+    events = list(read_traffic(str(log_path)))
+    report, results = replay(events, InProcessTarget(), speed=None, timeout=5)
+
+    assert report['completed'] == len(events)
+    assert report['timed_out'] == 0
+    assert report['latency_ms']['search.perform']['p99'] is not None
+    assert [r['term'] for r in results if r['event'] == 'search.perform'] == ['glucosa', 'hemoglobina', 'creatinina']
+
+    baseline = [dict(r) for r in results]
+    baseline[2] = dict(baseline[2], codes=['2345-7'])
+    drift = result_drift(results, baseline)
+    assert drift['compared'] == 3
+    assert drift['changed'] == 1
+    assert drift['changed_terms'] == ['glucosa']
+
+
+def test_gzip_capture_is_readable_before_close(tmp_path):
+    """Un log .gz se puede leer hasta el último volcado aunque no se haya cerrado"""
+    log_path = tmp_path / 'traffic.ndjson.gz'
+    recorder = TrafficRecorder(str(log_path), flush_every=2)
+    for i in range(5):
+        recorder.record('sid', 'search.perform', {'term': f'termino {i}'})
+
+    assert [e['d']['term'] for e in read_traffic(str(log_path))] == [f'termino {i}' for i in range(4)]
+
+    recorder.close()
+    recorder.close()
+    assert len(list(read_traffic(str(log_path)))) == 5
+
+
+def test_replay_reranks_with_fake_openai(tmp_path, monkeypatch):
+    """Las búsquedas grabadas con ontologyMode 'openai' pasan por el cliente OpenAI falso"""
+    log_path = tmp_path / 'traffic.ndjson'
+    _record_session(log_path, monkeypatch, config={'search': {'ontologyMode': 'openai'}})
+    monkeypatch.delenv('TRAFFIC_CAPTURE_PATH')
+    index = LoincIndex()
+    index.add_rows([
+        {'LOINC_NUM': '2345-7', 'LONG_COMMON_NAME': 'Glucosa en suero'},
+        {'LOINC_NUM': '2339-0', 'LONG_COMMON_NAME': 'Glucosa en sangre'},
+        {'LOINC_NUM': '718-7', 'LONG_COMMON_NAME': 'Hemoglobina en sangre'},
+    ])
+    monkeypatch.setitem(registry._instances, 'loinc_index', index)
+    monkeypatch.setitem(registry._instances, 'openai', OpenAIService())
+
+    fake_openai = install_fake_openai()
+    events = list(read_traffic(str(log_path)))
+    report, results = replay(events, InProcessTarget(), speed=None, timeout=5)
+
+    assert report['completed'] == len(events)
+    assert report['errors'] == 0
+    assert fake_openai.calls >= 1
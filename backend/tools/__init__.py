@@ -0,0 +1,2 @@
+# Este archivo está intencionalmente vacío
+# Su presencia indica que este directorio es un paquete de Python 
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Compara el ranking BM25 en Python puro con la versión vectorizada (CSR + NumPy).
+
+Uso (desde backend/):
+    python -m tools.benchmark_search                 # corpus sintético
+    python -m tools.benchmark_search --loinc Loinc.csv --queries 500
+"""
+import sys
+import time
+import random
+import argparse
+import logging
+from typing import List, Optional
+
+from services.loinc_index import LoincIndex, LOINC_COLUMNS
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+COMPONENTS = ['Glucose', 'Hemoglobin', 'Creatinine', 'Sodium', 'Potassium', 'Cholesterol',
+              'Albumin', 'Bilirubin', 'Calcium', 'Ferritin', 'Urea nitrogen', 'Triglyceride',
+              'Leukocytes', 'Erythrocytes', 'Platelets', 'Thyrotropin', 'Cortisol', 'Lactate']
+SYSTEMS = ['Ser/Plas', 'Bld', 'Urine', 'CSF', 'Ser', 'Plas', 'BldV', 'BldA']
+PROPERTIES = ['MCnc', 'SCnc', 'NCnc', 'ACnc', 'Prid', 'MRat']
+SCALES = ['Qn', 'Ord', 'Nom', 'Nar']
+CLASSES = ['CHEM', 'HEM/BC', 'UA', 'SERO', 'MICRO', 'DRUG/TOX']
+QUALIFIERS = ['mass', 'volume', 'moles', 'serum', 'plasma', 'blood', 'urine', 'test', 'strip',
+              'automated', 'count', 'presence', 'fasting', 'random', '24 hour', 'panel',
+              'method', 'measurement', 'ratio', 'level']
+
+
+def synthetic_index(size: int, seed: int = 42) -> LoincIndex:
+    """Índice con filas de estructura LOINC y vocabulario sesgado (Zipf)"""
+    rng = random.Random(seed)
+    extra_words = [f'term{i}' for i in range(2000)]
+    weights = [1 / (i + 1) for i in range(len(extra_words))]
+    rows = []
+    for i in range(size):
+        component = rng.choice(COMPONENTS)
+        system = rng.choice(SYSTEMS)
+        words = rng.sample(QUALIFIERS, 4) + rng.choices(extra_words, weights=weights, k=4)
+        rows.append({
+            'LOINC_NUM': f'{10000 + i}-{i % 10}',
+            'COMPONENT': component,
+            'PROPERTY': rng.choice(PROPERTIES),
+            'TIME_ASPCT': 'Pt',
+            'SYSTEM': system,
+            'SCALE_TYP': rng.choice(SCALES),
+            'METHOD_TYP': '',
+            'CLASS': rng.choice(CLASSES),
+            'LONG_COMMON_NAME': f"{component} [{' '.join(words)}] in {system}"
+        })
+    index = LoincIndex()
+    index.add_rows(rows)
+    return index
+
+
+def sample_queries(index: LoincIndex, count: int, max_keywords: int, seed: int = 7) -> List[str]:
+    """Consultas de 1 a max_keywords palabras tomadas de filas del índice"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        row = rng.choice(index.rows)
+        words = ' '.join(row[column] for column in ('LONG_COMMON_NAME', 'COMPONENT', 'SYSTEM')).split()
+        queries.append(' '.join(rng.sample(words, min(len(words), rng.randint(1, max_keywords)))))
+    return queries
+
+
+def _timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark del ranking BM25')
+    parser.add_argument('--loinc', help='Fichero Loinc.csv (por defecto: corpus sintético)')
+    parser.add_argument('--docs', type=int, default=50000, help='Tamaño del corpus sintético')
+    parser.add_argument('--queries', type=int, default=200, help='Número de consultas')
+    parser.add_argument('--max-keywords', type=int, default=10, help='Palabras clave por consulta')
+    parser.add_argument('--limit', type=int, default=50, help='Resultados por consulta (top-k)')
+    args = parser.parse_args(argv)
+
+    index = LoincIndex.from_csv(args.loinc) if args.loinc else synthetic_index(args.docs)
+    _, build_time = _timed(index.build_matrix)
+    queries = sample_queries(index, args.queries, args.max_keywords)
+    options = {'limit': args.limit, 'max_keywords': args.max_keywords}
+
+    python_results, python_time = _timed(lambda: [index.search_python(q, **options) for q in queries])
+    vector_results, vector_time = _timed(lambda: [index.search(q, **options) for q in queries])
+    batch_results, batch_time = _timed(lambda: index.search_batch(queries, **options))
+
+    mismatches = sum(
+        1 for expected, *others in zip(python_results, vector_results, batch_results)
+        for other in others
+        if [d for d, _ in expected] != [d for d, _ in other]
+        or any(abs(a - b) > 1e-9 for (_, a), (_, b) in zip(expected, other))
+    )
+
+    print(f"Documentos: {len(index)}  Consultas: {len(queries)}  Matriz CSR: {build_time:.2f}s")
+    print(f"Python puro:          {python_time * 1000 / len(queries):8.3f} ms/consulta")
+    print(f"Vectorizado:          {vector_time * 1000 / len(queries):8.3f} ms/consulta "
+          f"(x{python_time / vector_time:.1f})")
+    print(f"Vectorizado por lote: {batch_time * 1000 / len(queries):8.3f} ms/consulta "
+          f"(x{python_time / batch_time:.1f})")
+    print(f"Diferencias de ranking: {mismatches}")
+    return 0 if mismatches == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,306 @@
+"""
+Reproduce un log de tráfico grabado (TRAFFIC_CAPTURE_PATH) contra un servidor o en proceso.
+
+Uso (desde backend/):
+    python -m tools.replay_traffic traffic.ndjson --speed 10
+    python -m tools.replay_traffic traffic.ndjson --target http://localhost:5001 --speed 1
+    python -m tools.replay_traffic traffic.ndjson --speed max --output nueva.ndjson --baseline anterior.ndjson
+"""
+import sys
+import json
+import time
+import argparse
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.registry import registry
+from services.traffic_capture import read_traffic
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+# Eventos de respuesta que llevan request_id
+RESPONSE_EVENTS = ('search.results', 'storage_value', 'storage.value_set', 'storage.all_values')
+
+
+class FakeOpenAIClient:
+    """Sustituto de OpenAI: responde al instante y mantiene el orden de los candidatos"""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=self)
+        self.calls = 0
+
+    def create(self, model, messages, **kwargs):
+        self.calls += 1
+        prompt = messages[-1]['content']
+        results = []
+        for block in prompt.split('\n\n'):
+            lines = block.split('\n')
+            if not lines[0].startswith('Q'):
+                continue
+            query = int(lines[0].split(':')[0][1:])
+            results.append({'query': query, 'ranking': [line[2:].split(' | ')[0] for line in lines[1:]]})
+        content = json.dumps({'results': results}) if results else 'ok'
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def install_fake_openai() -> FakeOpenAIClient:
+    """
+    Inicializa el servicio OpenAI del registro con el cliente falso.
+    Las API keys del log están redactadas, así que cualquier instalación que pida
+    rerank (search.ontologyMode == 'openai') usa el cliente falso.
+    """
+    client = FakeOpenAIClient()
+    openai_service = registry.get('openai')
+
+    def initialize(websocket_service, install_timestamp) -> bool:
+        stored_key = openai_service.stored_key(websocket_service, install_timestamp)
+        openai_service.clients[str(install_timestamp)] = (stored_key, client)
+        return True
+
+    openai_service.initialize = initialize
+    return client
+
+
+class InProcessTarget:
+    def __init__(self):
+        """Servidor Flask-SocketIO en el mismo proceso con un cliente de test por sesión"""
+        from flask import Flask
+        from services.websocket_service import WebSocketService
+
+        self.app = Flask(__name__)
+        self.websocket = WebSocketService(self.app)
+        self.clients = {}
+
+    def emit(self, session: str, event: str, data: Dict[str, Any]):
+        if session not in self.clients:
+            self.clients[session] = self.websocket.socketio.test_client(self.app)
+            self.clients[session].get_received()
+        self.clients[session].emit(event, data)
+
+    def poll(self) -> List[Tuple[str, Dict[str, Any]]]:
+        received = []
+        for client in self.clients.values():
+            for message in client.get_received():
+                if message['name'] in RESPONSE_EVENTS and message['args']:
+                    received.append((message['name'], message['args'][0]))
+        return received
+
+    def sleep(self, seconds: float):
+        self.websocket.socketio.sleep(seconds)
+
+    def close(self):
+        for client in self.clients.values():
+            client.disconnect()
+
+
+class RemoteTarget:
+    def __init__(self, url: str):
+        """Servidor remoto con un cliente Socket.IO por sesión grabada"""
+        self.url = url
+        self.clients = {}
+        self.received = []
+        self._lock = threading.Lock()
+
+    def _connect(self, session: str):
+        import socketio
+
+        client = socketio.Client(ssl_verify=False)
+        for event in RESPONSE_EVENTS:
+            client.on(event, self._handler(event))
+        client.connect(self.url, transports=['websocket'])
+        self.clients[session] = client
+
+    def _handler(self, event: str):
+        def handle(data):
+            with self._lock:
+                self.received.append((event, data))
+        return handle
+
+    def emit(self, session: str, event: str, data: Dict[str, Any]):
+        if session not in self.clients:
+            self._connect(session)
+        self.clients[session].emit(event, data)
+
+    def poll(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            received, self.received = self.received, []
+        return received
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def close(self):
+        for client in self.clients.values():
+            client.disconnect()
+
+
+def _result_codes(payload: Dict[str, Any]) -> List[str]:
+    """Códigos devueltos en una respuesta de búsqueda"""
+    results = (payload.get('data') or {}).get('results') or []
+    return [str(r.get('code', r.get('loinc_num'))) if isinstance(r, dict) else str(r) for r in results]
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percentile / 100 * len(ordered))) - 1))
+    return round(ordered[index], 2)
+
+
+def replay(events: List[Dict[str, Any]], target, speed: Optional[float] = 1.0,
+           timeout: float = 10.0) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Reproduce los eventos respetando sus tiempos relativos divididos por `speed`.
+    Args:
+        events: Eventos leídos con read_traffic
+        target: InProcessTarget o RemoteTarget
+        speed: Factor de aceleración (None = tan rápido como sea posible)
+        timeout: Segundos máximos de espera para las respuestas pendientes al final
+    Returns:
+        (informe, resultado por petición)
+    """
+    pending: Dict[str, Dict[str, Any]] = {}
+    results: List[Dict[str, Any]] = []
+
+    def collect():
+        now = time.monotonic()
+        for event, payload in target.poll():
+            request = pending.pop(payload.get('request_id'), None)
+            if request is None:
+                continue
+            request['latency_ms'] = round((now - request.pop('sent')) * 1000, 3)
+            request['status'] = payload.get('status', 'error' if 'error' in payload else 'success')
+            if event == 'search.results' and request['status'] == 'success':
+                request['codes'] = _result_codes(payload)
+            results.append(request)
+
+    first_t = events[0]['t'] if events else 0
+    start = time.monotonic()
+    for i, recorded in enumerate(events):
+        if speed:
+            due = start + (recorded['t'] - first_t) / speed
+            while time.monotonic() < due:
+                collect()
+                target.sleep(min(0.001, max(0.0, due - time.monotonic())))
+
+        data = dict(recorded['d'])
+        request_id = f"replay_{i}"
+        pending[request_id] = {
+            'i': i,
+            'event': recorded['e'],
+            'request_id': data.get('request_id'),
+            'term': data.get('term'),
+            'sent': time.monotonic()
+        }
+        data['request_id'] = request_id
+        target.emit(recorded['s'], recorded['e'], data)
+        collect()
+        target.sleep(0)
+
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        target.sleep(0.001)
+        collect()
+    duration = time.monotonic() - start
+
+    results.sort(key=lambda r: r['i'])
+    report = {
+        'requests': len(events),
+        'completed': len(results),
+        'timed_out': len(pending),
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(results) / duration, 2) if duration else None,
+        'busy': sum(1 for r in results if r['status'] == 'busy'),
+        'errors': sum(1 for r in results if r['status'] == 'error'),
+        'latency_ms': {}
+    }
+    for event in sorted({r['event'] for r in results}):
+        latencies = [r['latency_ms'] for r in results if r['event'] == event]
+        report['latency_ms'][event] = {
+            'p50': _percentile(latencies, 50),
+            'p95': _percentile(latencies, 95),
+            'p99': _percentile(latencies, 99),
+            'max': round(max(latencies), 2)
+        }
+    return report, results
+
+
+def result_drift(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], k: int = 10) -> Dict[str, Any]:
+    """
+    Compara los resultados de búsqueda de dos builds sobre el mismo log.
+    Returns:
+        Consultas comparadas, cuántas cambian su top-k y el solapamiento medio del top-k
+    """
+    previous = {r['i']: r['codes'] for r in baseline if 'codes' in r}
+    compared = changed = 0
+    overlap_total = 0.0
+    changed_terms = []
+    for result in results:
+        if 'codes' not in result or result['i'] not in previous:
+            continue
+        current_top = result['codes'][:k]
+        previous_top = previous[result['i']][:k]
+        compared += 1
+        if current_top != previous_top:
+            changed += 1
+            changed_terms.append(result.get('term'))
+        union = set(current_top) | set(previous_top)
+        overlap_total += len(set(current_top) & set(previous_top)) / len(union) if union else 1.0
+    return {
+        'compared': compared,
+        'changed': changed,
+        'mean_overlap_at_k': round(overlap_total / compared, 4) if compared else None,
+        'changed_terms': changed_terms[:20]
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Reproduce tráfico grabado de búsquedas')
+    parser.add_argument('log', help='Log grabado con TRAFFIC_CAPTURE_PATH (.ndjson o .ndjson.gz)')
+    parser.add_argument('--target', help='URL del servidor (por defecto: en proceso)')
+    parser.add_argument('--speed', default='1', help="Factor de velocidad (1, 10, ...) o 'max'")
+    parser.add_argument('--timeout', type=float, default=10.0, help='Espera máxima de respuestas pendientes')
+    parser.add_argument('--output', help='Guardar los resultados por petición (NDJSON)')
+    parser.add_argument('--baseline', help='Resultados de otro build para calcular la deriva')
+    parser.add_argument('--top-k', type=int, default=10, help='Profundidad para comparar rankings')
+    args = parser.parse_args(argv)
+
+    events = list(read_traffic(args.log))
+    speed = None if args.speed == 'max' else float(args.speed)
+
+    fake_openai = None
+    if args.target:
+        target = RemoteTarget(args.target)
+    else:
+        fake_openai = install_fake_openai()
+        target = InProcessTarget()
+
+    logger.info(f"▶️ Reproduciendo {len(events)} eventos a velocidad {args.speed}")
+    try:
+        report, results = replay(events, target, speed=speed, timeout=args.timeout)
+    finally:
+        target.close()
+
+    if fake_openai is not None:
+        report['openai_calls'] = fake_openai.calls
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = [json.loads(line) for line in f if line.strip()]
+        report['drift'] = result_drift(results, baseline, k=args.top_k)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if not report['timed_out'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
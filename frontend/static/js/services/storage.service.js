@@ -350,6 +350,7 @@ class StorageService {
                     window.socket.emit('storage.set_value', {
                         key: 'searchConfig',
                         value: config,
+                        installTimestamp: timestamp,
                         request_id: `${syncId}_config`
                     });
                     resolve();
@@ -361,6 +362,7 @@ class StorageService {
                     window.socket.emit('storage.set_value', {
                         key: 'openaiApiKey',
                         value: apiKey,
+                        installTimestamp: timestamp,
                         request_id: `${syncId}_apikey`
                     });
                     resolve();
@@ -372,6 +374,7 @@ class StorageService {
                     window.socket.emit('storage.set_value', {
                         key: 'installTimestamp',
                         value: timestamp,
+                        installTimestamp: timestamp,
                         request_id: `${syncId}_timestamp`
                     });
                     resolve();
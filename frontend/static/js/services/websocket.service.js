@@ -46,7 +46,11 @@ class WebSocketService {
                         multiplex: true,
                         // No forzar nueva conexión
                         forceNew: false,
-                        autoConnect: false
+                        autoConnect: false,
+                        // Identificar la instalación en cada (re)conexión para unirse a su sala
+                        auth: (cb) => cb({
+                            installTimestamp: localStorage.getItem('installTimestamp')
+                        })
                     });
 
                     window.socket = this.socket;
@@ -208,7 +212,11 @@ class WebSocketService {
             }, 5000);
 
             this.pendingRequests.set(requestId, { resolve, reject, timeout });
-            this.socket.emit(event, { ...data, request_id: requestId });
+            this.socket.emit(event, {
+                ...data,
+                installTimestamp: localStorage.getItem('installTimestamp'),
+                request_id: requestId
+            });
         });
     }
 }